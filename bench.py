@@ -0,0 +1,247 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from colors import trunk_colors, leaves_colors, plant_pot_colors
+from forest import ForestBuilder
+from main import GEN_PARAMS, RENDER_BACKENDS, RENDER_SUFFIXES, draw_tree_with_widths, seed_tree, tree_seed
+from recur import branch_seeds, generate_feedback_trunk_with_buds, generate_tree, grow_branch_forest, grow_branch_tree_list
+from scene import assign_path_widths
+from util import export_tree_to_json, import_tree_from_json
+
+# fixed so every run times the same trees; change it and old results stop
+# being comparable
+BENCH_SEED = 1234
+
+PROFILES = {
+    "small": dict(GEN_PARAMS, n=4, max_depth=2),
+    "default": dict(GEN_PARAMS),
+    "crown": dict(GEN_PARAMS, n=8, max_depth=4, length_range=(30, 50)),
+    "deep": dict(GEN_PARAMS, max_depth=8),
+}
+GENERATION_CASES = ["trunk", "branches", "branch_list", "widths", "json"]
+
+
+def prepare_trees(params, count):
+    # the inputs each case starts from, built outside the timed region
+    trees = []
+    for i in range(count):
+        seed = tree_seed(BENCH_SEED, i)
+        seed_tree(seed)
+        x_vals, y_vals, buds = generate_feedback_trunk_with_buds(n=params["n"], length_range=params["length_range"], trunk_segments=[])
+        seeds = branch_seeds(buds)
+        seed_tree(seed)
+        trunks, buds, branches, leaves = generate_tree(**params)
+        seed_tree(seed)
+        trunk_widths, branch_widths = assign_path_widths(trunks, branches, trunk_main_width=60, trunk_min_width=1)
+        trees.append(dict(seed=seed, seeds=seeds, skeleton=(trunks, buds, branches, leaves),
+                          widths=(trunk_widths, branch_widths)))
+    return trees
+
+
+def case_trunk(params, tree, workdir):
+    seed_tree(tree["seed"])
+    x_vals, y_vals, buds = generate_feedback_trunk_with_buds(n=params["n"], length_range=params["length_range"], trunk_segments=[])
+    return len(x_vals)
+
+
+def case_branches(params, tree, workdir):
+    # the budgeted level by level growth generate_tree uses
+    seed_tree(tree["seed"])
+    builder = ForestBuilder()
+    grow_branch_forest(builder, tree["seeds"], max_depth=params["max_depth"], base_step=params["base_step"],
+                       angle_range=params["angle_range"], node_budget=params["node_budget"],
+                       segment_budget=params["segment_budget"])
+    return builder.build().node_count
+
+
+def case_branch_list(params, tree, workdir):
+    # one nested tree per seed through the older recursive API, no budget
+    seed_tree(tree["seed"])
+    nodes = 0
+    for start_pos, angle, depth, ratio, is_top_branch in tree["seeds"]:
+        branch = grow_branch_tree_list(start_pos, angle, depth, ratio, is_top_branch, max_depth=params["max_depth"],
+                                       base_step=params["base_step"], angle_range=params["angle_range"])
+        nodes += branch is not None
+    return nodes
+
+
+def case_widths(params, tree, workdir):
+    trunks, buds, branches, leaves = tree["skeleton"]
+    seed_tree(tree["seed"])
+    trunk_widths, branch_widths = assign_path_widths(trunks, branches, trunk_main_width=60, trunk_min_width=1)
+    return sum(len(w) for w in trunk_widths) + len(branch_widths)
+
+
+def case_json(params, tree, workdir):
+    filename = os.path.join(workdir, "skeleton.json")
+    trunks, buds, branches, leaves = tree["skeleton"]
+    export_tree_to_json(filename, trunks, buds, branches, leaves)
+    import_tree_from_json(filename)
+    return os.path.getsize(filename)
+
+
+def render_case(backend, dpi):
+    def case_render(params, tree, workdir):
+        filename = os.path.join(workdir, f"tree{RENDER_SUFFIXES[backend]}")
+        trunks, buds, branches, leaves = tree["skeleton"]
+        trunk_widths, branch_widths = tree["widths"]
+        seed_tree(tree["seed"])
+        draw_tree_with_widths(trunks, trunk_widths, branches, branch_widths, buds=buds, leaves=leaves, filename=filename,
+                              trunk_color=trunk_colors[0], leaf_color=leaves_colors[0], pot_color=plant_pot_colors[0],
+                              dpi=dpi, backend=backend)
+        return os.path.getsize(filename)
+    return case_render
+
+
+UNITS = {"trunk": "points", "branches": "nodes", "branch_list": "branches", "widths": "widths", "json": "bytes"}
+CASES = {"trunk": case_trunk, "branches": case_branches, "branch_list": case_branch_list,
+         "widths": case_widths, "json": case_json}
+
+
+def time_case(fn, params, trees, workdir, repeats=3, memory=True):
+    # warm caches and lazy imports on the first tree, then time whole passes
+    # over every tree; the best pass is the least noisy number to compare
+    with contextlib.redirect_stdout(io.StringIO()):
+        return _time_case(fn, params, trees, workdir, repeats, memory)
+
+
+def _time_case(fn, params, trees, workdir, repeats, memory):
+    fn(params, trees[0], workdir)
+    passes = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        units = sum(fn(params, tree, workdir) for tree in trees)
+        passes.append(time.perf_counter() - start)
+
+    peak = None
+    if memory:
+        # a separate pass, since tracing slows everything it measures
+        tracemalloc.start()
+        peak = 0
+        for tree in trees:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            fn(params, tree, workdir)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+        tracemalloc.stop()
+
+    best = min(passes)
+    return {
+        "trees": len(trees),
+        "units": int(units),
+        "best": best,
+        "median": statistics.median(passes),
+        "ms_per_tree": best / len(trees) * 1e3,
+        "trees_per_sec": len(trees) / best,
+        "units_per_sec": units / best,
+        "peak_bytes": peak,
+    }
+
+
+def environment():
+    import matplotlib
+    import PIL
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "matplotlib": matplotlib.__version__,
+        "pillow": PIL.__version__,
+        "machine": platform.machine(),
+        "system": platform.system(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def run_benchmarks(profiles, cases, dpis, backends, trees=5, repeats=3, memory=True):
+    cases = list(cases) + [f"render_{backend}_{dpi:g}" for backend in backends for dpi in dpis]
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for profile in profiles:
+            params = PROFILES[profile]
+            inputs = prepare_trees(params, trees)
+            for name in cases:
+                if name.startswith("render_"):
+                    _, backend, dpi = name.split("_")
+                    fn = render_case(backend, float(dpi))
+                else:
+                    fn = CASES[name]
+                result = time_case(fn, params, inputs, workdir, repeats=repeats, memory=memory)
+                result["unit"] = UNITS.get(name, "bytes")
+                results[f"{profile}/{name}"] = result
+                print(format_result(f"{profile}/{name}", result), flush=True)
+    return {
+        "config": {"seed": BENCH_SEED, "trees": trees, "repeats": repeats, "profiles": {p: PROFILES[p] for p in profiles}},
+        "environment": environment(),
+        "results": results,
+    }
+
+
+def format_result(name, r):
+    peak = f"{r['peak_bytes'] / 2 ** 20:8.2f}MiB" if r["peak_bytes"] is not None else " " * 11
+    return (f"{name:<28} {r['ms_per_tree']:9.2f}ms/tree {r['trees_per_sec']:9.1f} trees/s "
+            f"{r['units_per_sec']:12.4g} {r['unit']}/s  peak {peak}")
+
+
+def compare(report, baseline, threshold=0.1):
+    # best pass against best pass; a case only counts when both runs did the
+    # same work, otherwise the trees themselves changed and timing says nothing
+    lines, regressions = [], []
+    config, old_config = json.loads(json.dumps(report["config"])), baseline["config"]
+    shared = set(config["profiles"]) & set(old_config["profiles"])
+    if (config["seed"], config["trees"]) != (old_config["seed"], old_config["trees"]) or \
+            any(config["profiles"][p] != old_config["profiles"][p] for p in shared):
+        lines.append("warning: benchmark config differs from the baseline")
+    if baseline.get("environment") != report["environment"]:
+        lines.append("warning: environment differs from the baseline")
+    for name, r in report["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            continue
+        if old["units"] != r["units"]:
+            lines.append(f"{name:<28} workload changed ({old['units']} -> {r['units']} {r['unit']})")
+            continue
+        ratio = r["best"] / old["best"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            flag = "  faster"
+        lines.append(f"{name:<28} {old['ms_per_tree']:9.2f} -> {r['ms_per_tree']:9.2f}ms/tree  x{ratio:5.2f}{flag}")
+    return "\n".join(lines), regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time tree generation, rendering and serialisation on fixed seeds.")
+    parser.add_argument("--profiles", nargs="*", default=list(PROFILES), choices=list(PROFILES))
+    parser.add_argument("--cases", nargs="*", default=GENERATION_CASES, choices=list(CASES))
+    parser.add_argument("--dpi", nargs="*", type=float, default=[50, 150], help="render each profile at these dpis")
+    parser.add_argument("--backend", nargs="*", default=["matplotlib", "raster"], choices=sorted(RENDER_BACKENDS))
+    parser.add_argument("--trees", type=int, default=5, help="trees per profile")
+    parser.add_argument("--repeats", type=int, default=3, help="timed passes per case, the best one is reported")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--json", default=None, help="save results to this file")
+    parser.add_argument("--compare", default=None, help="baseline results from an earlier --json run")
+    parser.add_argument("--threshold", type=float, default=0.1, help="slowdown that counts as a regression")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.profiles, args.cases, args.dpi, args.backend, trees=args.trees,
+                            repeats=args.repeats, memory=not args.no_memory)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            text, regressions = compare(report, json.load(f), threshold=args.threshold)
+        print(text)
+        if regressions:
+            sys.exit(1)
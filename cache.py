@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+
+
+def cache_key(*parts):
+    blob = json.dumps(parts, sort_keys=True, default=list)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    # content-addressed files under root, evicted least-recently-used first
+    # once the total size goes over max_bytes. Workers sharing root each keep
+    # their own estimate, so every rescan_bytes of writes a worker rescans to
+    # see the others' too; n workers overshoot by at most n * rescan_bytes.
+    def __init__(self, root, max_bytes=1 << 30, rescan_bytes=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.rescan_bytes = max_bytes // 100 if rescan_bytes is None else rescan_bytes
+        self._size = None
+        self._written = 0
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key, ext=""):
+        return os.path.join(self.root, key[:2], key + ext)
+
+    def _touch(self, path):
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _write(self, path, write):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        # only rescan the directory once our running estimate crosses the limit
+        # or we have written enough that the other workers' writes may have
+        size = os.path.getsize(path)
+        self._written += size
+        if self._size is not None:
+            self._size += size
+        if self._size is None or self._size > self.max_bytes or self._written >= self.rescan_bytes:
+            self.evict()
+
+    def get_object(self, key):
+        path = self.path(key, ".pkl")
+        if not self._touch(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def put_object(self, key, obj):
+        self._write(self.path(key, ".pkl"), lambda f: pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def get_file(self, key, dest, ext=""):
+        path = self.path(key, ext)
+        if not self._touch(path):
+            return False
+        try:
+            shutil.copyfile(path, dest)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put_file(self, key, src, ext=""):
+        def write(f):
+            with open(src, "rb") as s:
+                shutil.copyfileobj(s, f)
+        self._write(self.path(key, ext), write)
+
+    def evict(self):
+        entries = []
+        total = 0
+        for dirpath, _, files in os.walk(self.root):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        # evict down to 90% so the next few writes don't trigger another scan
+        target = self.max_bytes * 0.9 if total > self.max_bytes else total
+        entries.sort()
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._size = total
+        self._written = 0
@@ -0,0 +1,71 @@
+from collections import OrderedDict
+from PIL import Image
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import metrics
+from scene import view_limits
+
+# each context pins a full size buffer, so only the few most recently used
+# dpis keep theirs; a service asked for many dpis would otherwise grow forever
+MAX_CONTEXTS = 2
+_contexts = OrderedDict()
+
+
+class RenderContext:
+    # one figure and Agg canvas reused for every tree a worker renders; the
+    # axes fill the figure and the view comes from the scene bounds, so saving
+    # draws the scene exactly once
+    def __init__(self, size=10, dpi=300, margin=0.1):
+        self.size = size
+        self.dpi = dpi
+        self.margin = margin
+        self.figure = Figure(figsize=(size, size), dpi=dpi, facecolor='white')
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_axes([0, 0, 1, 1])
+        self.ax.set_aspect('equal', adjustable='datalim')
+        self.ax.set_autoscale_on(False)
+        self.ax.axis('off')
+
+    def close(self):
+        # the figure and canvas refer to each other, so the buffer would
+        # otherwise live until the next garbage collection
+        self.figure.clear()
+        self.canvas.renderer = None
+        self.canvas._lastKey = None
+
+    def begin(self):
+        for artist in self.ax.collections[:] + self.ax.patches[:] + self.ax.lines[:]:
+            artist.remove()
+        return self.ax
+
+    def set_view(self, bounds, pad_points=0):
+        xmin, xmax, ymin, ymax = view_limits(bounds, pad_points, self.size, self.margin)
+        self.ax.set_xlim(xmin, xmax)
+        self.ax.set_ylim(ymin, ymax)
+
+    def save(self, filename, writer=None):
+        # draw once and encode the buffer ourselves, so rasterising and PNG
+        # encoding are timed apart; the figure is opaque, so RGB loses nothing.
+        # The RGB copy is free of the shared canvas, so a writer can encode it
+        # in the background while the next tree is drawn.
+        with metrics.stage("rasterize"):
+            self.canvas.draw()
+        with metrics.stage("png"):
+            width, height = self.canvas.get_width_height()
+            image = Image.frombuffer("RGBA", (width, height), self.canvas.buffer_rgba(), "raw", "RGBA", 0, 1).convert("RGB")
+            if writer is None:
+                image.save(filename, dpi=(self.dpi, self.dpi))
+            else:
+                writer.submit(filename, image.save, filename, dpi=(self.dpi, self.dpi))
+
+
+def render_context(dpi=300, size=10):
+    key = (dpi, size)
+    if key in _contexts:
+        _contexts.move_to_end(key)
+    else:
+        _contexts[key] = RenderContext(size=size, dpi=dpi)
+        while len(_contexts) > MAX_CONTEXTS:
+            _contexts.popitem(last=False)[1].close()
+    return _contexts[key]
+
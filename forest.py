@@ -0,0 +1,163 @@
+import numpy as np
+
+
+class BranchNode:
+    # lightweight view of one node, for code that still wants node["points"] / node["children"]
+    __slots__ = ("forest", "index")
+
+    def __init__(self, forest, index):
+        self.forest = forest
+        self.index = index
+
+    @property
+    def points(self):
+        return self.forest.node_points(self.index)
+
+    @property
+    def children(self):
+        return [BranchNode(self.forest, int(i)) for i in self.forest.children_of(self.index)]
+
+    @property
+    def depth(self):
+        return int(self.forest.depth[self.index])
+
+    def __getitem__(self, key):
+        if key == "points":
+            return self.points.tolist()
+        if key == "children":
+            return self.children
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+class BranchForest:
+    # every branch node of every branch tree of one bonsai. Node i owns
+    # points[offsets[i]:offsets[i + 1]]; parents[i] is -1 for a tree root and
+    # always smaller than i otherwise; depth is 0 at the roots.
+    __slots__ = ("points", "offsets", "parents", "depth")
+
+    def __init__(self, points=None, offsets=None, parents=None, depth=None):
+        self.points = np.asarray(points if points is not None else np.empty((0, 2)), dtype=float).reshape(-1, 2)
+        self.offsets = np.asarray(offsets if offsets is not None else [0], dtype=np.int64)
+        self.parents = np.asarray(parents if parents is not None else [], dtype=np.int64)
+        self.depth = np.asarray(depth, dtype=np.int64) if depth is not None else self._depth_from_parents()
+
+    def _depth_from_parents(self):
+        depth = np.zeros(len(self.parents), dtype=np.int64)
+        cur = self.parents.copy()
+        while (cur >= 0).any():
+            up = cur >= 0
+            depth += up
+            cur[up] = self.parents[cur[up]]
+        return depth
+
+    @classmethod
+    def from_trees(cls, branch_trees):
+        builder = ForestBuilder()
+        stack = [(tree, -1, 0) for tree in reversed(list(branch_trees))]
+        while stack:
+            node, parent, depth = stack.pop()
+            index = builder.add(node["points"], parent, depth)
+            stack.extend((child, index, depth + 1) for child in reversed(node.get("children", [])))
+        return builder.build()
+
+    def __len__(self):
+        return len(self.roots())
+
+    def __iter__(self):
+        return (BranchNode(self, int(i)) for i in self.roots())
+
+    def __getitem__(self, i):
+        return BranchNode(self, int(self.roots()[i]))
+
+    @property
+    def node_count(self):
+        return len(self.parents)
+
+    def roots(self):
+        return np.flatnonzero(self.parents < 0)
+
+    def node_points(self, i):
+        return self.points[self.offsets[i]:self.offsets[i + 1]]
+
+    def node_lengths(self):
+        return np.diff(self.offsets)
+
+    def children_of(self, i):
+        return np.flatnonzero(self.parents == i)
+
+    def root_of(self):
+        root = np.where(self.parents < 0, np.arange(len(self.parents)), self.parents)
+        while True:
+            nxt = root[root]
+            if np.array_equal(nxt, root):
+                return root
+            root = nxt
+
+    def root_starts(self):
+        return self.points[self.offsets[self.roots()]]
+
+    def tips(self):
+        is_tip = np.ones(len(self.parents), dtype=bool)
+        is_tip[self.parents[self.parents >= 0]] = False
+        ends = self.offsets[1:][is_tip] - 1
+        return self.points[ends]
+
+    def _segment_starts(self):
+        # point indices that begin a segment, i.e. every point but the last of its node
+        starts = np.ones(len(self.points), dtype=bool)
+        starts[self.offsets[1:] - 1] = False
+        return np.flatnonzero(starts)
+
+    def segments(self):
+        idx = self._segment_starts()
+        return np.stack([self.points[idx], self.points[idx + 1]], axis=1)
+
+    def segment_widths(self, root_widths, decay=0.7):
+        # each node tapers linearly from start to start * decay, and children
+        # start where their parent ended, so start = root width * decay ** depth
+        root_widths = np.asarray(root_widths, dtype=float)
+        lengths = self.node_lengths()
+        start = root_widths[np.searchsorted(self.roots(), self.root_of())] * decay ** self.depth
+
+        node = np.repeat(np.arange(len(lengths)), lengths)
+        local = np.arange(len(self.points)) - self.offsets[node]
+        span = np.maximum(lengths - 1, 1)[node]
+        widths = start[node] * (1 + (decay - 1) * local / span)
+        return widths[self._segment_starts()]
+
+    def to_trees(self):
+        nodes = [{"points": self.node_points(i).tolist(), "children": []} for i in range(len(self.parents))]
+        trees = []
+        for node, parent in zip(nodes, self.parents.tolist()):
+            (trees if parent < 0 else nodes[parent]["children"]).append(node)
+        return trees
+
+
+class ForestBuilder:
+    def __init__(self):
+        self.points = []
+        self.offsets = [0]
+        self.parents = []
+        self.depth = []
+
+    def add(self, points, parent=-1, depth=0):
+        self.points.extend(points)
+        self.offsets.append(len(self.points))
+        self.parents.append(parent)
+        self.depth.append(depth)
+        return len(self.parents) - 1
+
+    def build(self):
+        return BranchForest(self.points, self.offsets, self.parents, self.depth)
+
+
+def as_forest(branch_trees):
+    if isinstance(branch_trees, BranchForest):
+        return branch_trees
+    return BranchForest.from_trees(branch_trees or [])
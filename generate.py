@@ -0,0 +1,62 @@
+import argparse
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from main import GEN_PARAMS, seed_tree, tree_seed
+from recur import generate_tree
+from util import export_tree_to_json, export_trees_to_binary
+
+# skeletons only: nothing here imports matplotlib, scipy or PIL, so short
+# lived workers start in numpy time. Render the output with render_archive.py.
+
+
+def iter_trees(seeds, gen_params=None):
+    # (seed, skeleton) pairs, each grown only when it is asked for, so a seed
+    # stream of any length never holds more than the tree in hand
+    params = {**GEN_PARAMS, **(gen_params or {})}
+    for seed in seeds:
+        seed_tree(seed)
+        yield seed, generate_tree(**params)
+
+
+def generate_skeleton(index, base_seed=0, gen_params=None):
+    # the same tree main.py would render for this index and base seed
+    return next(iter_trees([tree_seed(base_seed, index)], gen_params))[1]
+
+
+def generate_skeletons(count, out, workers=1, base_seed=0, gen_params=None):
+    # a .bin path gets one binary pack, anything else a directory of ske_<i>.json
+    job = partial(generate_skeleton, base_seed=base_seed, gen_params=gen_params)
+    if workers <= 1:
+        skeletons = map(job, range(count))
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        skeletons = pool.map(job, range(count), chunksize=max(1, count // (workers * 4)))
+    try:
+        if out.endswith(".bin"):
+            export_trees_to_binary(out, list(skeletons), names=[f"ske_{i}" for i in range(count)])
+        else:
+            os.makedirs(out, exist_ok=True)
+            for i, skeleton in enumerate(skeletons):
+                export_tree_to_json(os.path.join(out, f"ske_{i}.json"), *skeleton)
+    finally:
+        if workers > 1:
+            pool.shutdown()
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate bonsai skeletons without rendering them.")
+    parser.add_argument("out", help="binary pack (.bin) or directory for JSON skeletons")
+    parser.add_argument("--count", type=int, default=50, help="number of trees")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes")
+    parser.add_argument("--seed", type=int, default=None, help="base seed, random if omitted")
+    parser.add_argument("--max-depth", type=int, default=GEN_PARAMS["max_depth"], help="branching levels per branch tree")
+    parser.add_argument("--node-budget", type=int, default=GEN_PARAMS["node_budget"], help="most branch nodes per tree")
+    args = parser.parse_args()
+
+    base_seed = args.seed if args.seed is not None else random.randrange(2**32)
+    print(f"Base seed {base_seed}")
+    generate_skeletons(args.count, args.out, workers=args.workers, base_seed=base_seed,
+                       gen_params=dict(max_depth=args.max_depth, node_budget=args.node_budget))
@@ -1,31 +1,41 @@
+import argparse
+import importlib
+import itertools
 import random
 import math
 import os
+# workers never show a window; pick Agg before anything can import pyplot
+os.environ.setdefault("MPLBACKEND", "Agg")
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.collections import LineCollection
+import metrics
+from cache import DiskCache, cache_key
 from colors import trunk_colors, leaves_colors, plant_pot_colors
 from pot import draw_plant_pot
-from recur import draw_random_trunk_curve
+from scene import assign_path_widths, build_scene, collect_leaf_positions, cull_hidden_leaves, flatten_branch_segments, sample_canopy_leaves
+from recur import generate_tree, write_skeleton_outputs, SKELETON_OUTPUTS
+from trunks import kdtree_class
+from scoring import first_passing, parse_limits, SCORE_LIMITS
 
 
-def draw_tree_canopy(ax, center, width, height, leaf_color, leaf_count=200):
-    cx, cy = center
+def draw_leaf_collection(ax, offsets, leaf_widths, leaf_heights, angles, colors):
+    from matplotlib.collections import EllipseCollection
+
+    if len(offsets) == 0:
+        return None
+    pad = max(leaf_widths.max(), leaf_heights.max()) / 2
+    ax.update_datalim(np.vstack([offsets - pad, offsets + pad]))
 
-    for _ in range(leaf_count):
-        while True:
-            x = np.random.uniform(cx - width / 2, cx + width / 2)
-            y = np.random.uniform(cy - height / 2, cy + height / 2)
-            if ((x - cx) / (width / 2))**2 + ((y - cy) / (height / 2))**2 <= 1:
-                break
-        
-        leaf_width = np.random.uniform(1.5, 3)
-        leaf_height = np.random.uniform(4, 7)
-        angle = np.random.normal(loc=180, scale=10)
-
-        leaf = Ellipse((x, y), width=leaf_width, height=leaf_height, angle=angle,
-                       color=random.choice(leaf_color), alpha=0.8)
-        ax.add_patch(leaf)
+    leaves = EllipseCollection(leaf_widths, leaf_heights, angles, units='xy',
+                               offsets=offsets, offset_transform=ax.transData,
+                               facecolors=colors, edgecolors='face', alpha=0.8)
+    ax.add_collection(leaves, autolim=False)
+    return leaves
+
+
+def draw_tree_canopy(ax, center, width, height, leaf_color, leaf_count=200):
+    return draw_leaf_collection(ax, *sample_canopy_leaves([center], width, height, leaf_color, leaf_count))
 
 def generate_leaf_cluster(center, count=4, radius=6, size_range=(5, 7), aspect_ratio=0.5):
     cx, cy = center
@@ -47,103 +57,267 @@ def generate_leaf_cluster(center, count=4, radius=6, size_range=(5, 7), aspect_r
     return cluster
 
 
-def collect_leaf_positions(buds, branch_trees):
-    leaf_positions = []
-    def dfs(node):
-        pts = node["points"]
-        if not node["children"]:
-            leaf_positions.append(tuple(pts[-1]))
-        for child in node["children"]:
-            dfs(child)
+def draw_elliptical_leaves(ax, leaf_positions, leaf_color, width=60, height=25, leaf_count=50):
+    # one collection for every leaf of every tip
+    leaves = sample_canopy_leaves(leaf_positions, width, height, leaf_color, leaf_count)
+    return draw_leaf_collection(ax, *leaves)
+
 
-    for tree in branch_trees:
-        dfs(tree)
+def draw_branch_forest(ax, branches, branch_widths, color, decay=0.7):
+    segments, widths = flatten_branch_segments(branches, branch_widths, decay=decay)
+    return draw_branch_segments(ax, segments, widths, color)
 
-    return leaf_positions
 
+def draw_trunk(ax, points, widths, color):
+    from matplotlib.collections import LineCollection
 
-from matplotlib.patches import Ellipse
+    segments = np.stack([points[:-1], points[1:]], axis=1)
+    lc = LineCollection(segments, linewidths=widths[:-1], colors=color, capstyle='round', joinstyle='round')
+    ax.add_collection(lc, autolim=False)
+    return lc
 
-def draw_elliptical_leaves(ax, leaf_positions, leaf_color):
-    for (x, y) in leaf_positions:
-        draw_tree_canopy(ax, (x, y), width=60, height=25, leaf_color=leaf_color, leaf_count=50)
 
+def draw_branch_segments(ax, segments, widths, color):
+    from matplotlib.collections import LineCollection
 
-def assign_path_widths(trunks, branch_trees, trunk_main_width=50, trunk_min_width=1):
-    trunk_widths = []
-    for i, (xs, ys) in enumerate(trunks):
-        L = len(xs)
-        start_w = trunk_main_width if i == 0 else trunk_main_width / 2
-        end_w = trunk_min_width if i == 0 else trunk_min_width / 2
-        widths = np.linspace(start_w, end_w, L)
-        trunk_widths.append(widths)
+    if len(segments) == 0:
+        return None
+    lc = LineCollection(segments, linewidths=widths, colors=color, capstyle='projecting', joinstyle='round', zorder=1)
+    ax.add_collection(lc, autolim=False)
+    return lc
 
-    width_map = {}
-    for (xs, ys), ws in zip(trunks, trunk_widths):
-        for i in range(len(xs)):
-            key = (round(xs[i], 2), round(ys[i], 2))
-            width_map[key] = ws[i]
 
-    branch_start_widths = []
-    for tree in branch_trees:
-        x0, y0 = tree["points"][0]
-        key = (round(x0, 2), round(y0, 2))
-        start_width = min(10, width_map.get(key, 10) // 2)
-        branch_start_widths.append(start_width)
+def draw_scene_matplotlib(scene, filename, dpi=300, context=None, writer=None):
+    from canvas import render_context
 
-    return trunk_widths, branch_start_widths
+    context = context or render_context(dpi)
+    # Agg pays per ellipse, so leaves buried in dense crowns are worth dropping
+    with metrics.stage("cull"):
+        scene = cull_hidden_leaves(scene, dpi, size=context.size, margin=context.margin)
+    ax = context.begin()
 
+    with metrics.stage("pot"):
+        draw_plant_pot(ax, *scene["pot_origin"], pot_color=scene["pot_color"])
+    with metrics.stage("trunk"):
+        for points, widths in scene["trunks"]:
+            draw_trunk(ax, points, widths, scene["trunk_color"])
+    with metrics.stage("branches"):
+        draw_branch_segments(ax, scene["branch_segments"], scene["branch_widths"], scene["trunk_color"])
+    with metrics.stage("canopy"):
+        draw_leaf_collection(ax, *scene["leaves"])
+    metrics.count("leaves_drawn", len(scene["leaves"][0]))
+    metrics.count("artists", len(ax.get_children()))
 
-def draw_branch_tree_recursive(branch_node, start_width, ax, color, decay=0.7):
-    points = branch_node["points"]
-    xs = [p[0] for p in points]
-    ys = [p[1] for p in points]
-    L = len(xs)
+    context.set_view(scene["bounds"], pad_points=scene["pad_points"])
+    context.save(filename, writer=writer)
 
-    end_width = start_width * decay
-    widths = np.linspace(start_width, end_width, L)
 
-    for i in range(1, L):
-        ax.plot([xs[i-1], xs[i]], [ys[i-1], ys[i]], color=color, linewidth=widths[i-1], zorder=1)
+def draw_scene_raster(scene, filename, dpi=300, context=None, writer=None):
+    from raster import render_scene
 
-    child_start_width = widths[-1]
+    render_scene(scene, filename, dpi=dpi, writer=writer)
 
-    for child in branch_node.get("children", []):
-        draw_branch_tree_recursive(child, child_start_width, ax, decay=decay, color=color)
 
+def draw_scene_svg(scene, filename, dpi=300, context=None, writer=None):
+    from svg import write_svg
 
-def draw_tree_with_widths(trunks, trunk_widths, branches, branch_widths, buds=None, leaves=None, filename="tree_filled.png", trunk_color=["#43371f"], leaf_color=["#558172", "#96c49f"], pot_color=["4f4c5d"]):
-    _, ax = plt.subplots(figsize=(10, 10))
-    ax.set_aspect('equal')
-    ax.axis('off')
+    # the scene is this tree's alone, so a writer can build and stream the
+    # whole file while the next tree is drawn
+    if writer is None:
+        with metrics.stage("svg"):
+            write_svg(scene, filename)
+    else:
+        writer.submit(filename, write_svg, scene, filename)
 
-    root = (trunks[0][0][0], trunks[0][1][0])
-    selected_pot_color = random.choice(pot_color)
-    draw_plant_pot(ax, root[0], root[1] - 17, pot_color=selected_pot_color)
 
+RENDER_BACKENDS = {
+    "matplotlib": draw_scene_matplotlib,
+    "raster": draw_scene_raster,
+    "svg": draw_scene_svg,
+}
 
-    selected_trunk_color = random.choice(trunk_color)
-    for (xs, ys), ws in zip(trunks, trunk_widths):
-        segments = [([xs[i - 1], ys[i - 1]], [xs[i], ys[i]]) for i in range(1, len(xs))]
-        lc = LineCollection(segments, linewidths=ws[:-1], colors=selected_trunk_color, capstyle='round', joinstyle='round')
-        ax.add_collection(lc)
+# modules each backend imports on first use
+RENDER_MODULES = {
+    "matplotlib": "canvas",
+    "raster": "raster",
+    "svg": "svg",
+}
 
-    for branch, start_width in zip(branches, branch_widths):
-        draw_branch_tree_recursive(branch, start_width, ax, color=selected_trunk_color)
+RENDER_SUFFIXES = {
+    "matplotlib": ".png",
+    "raster": ".png",
+    "svg": ".svg",
+}
 
-    leaf_pos = collect_leaf_positions(buds, branches)
-    draw_elliptical_leaves(ax, leaf_pos, leaf_color)
 
-    plt.tight_layout()
-    plt.savefig(filename, dpi=300, bbox_inches='tight')
-    plt.close()
+def draw_tree_with_widths(trunks, trunk_widths, branches, branch_widths, buds=None, leaves=None, filename="tree_filled.png", trunk_color=["#43371f"], leaf_color=["#558172", "#96c49f"], pot_color=["4f4c5d"], dpi=300, context=None, backend="matplotlib", lod=False, writer=None):
+    # renders are 10 inches square, so lod trims detail below a pixel at this dpi
+    with metrics.stage("scene"):
+        scene = build_scene(trunks, trunk_widths, branches, branch_widths, buds=buds,
+                            trunk_color=trunk_color, leaf_color=leaf_color, pot_color=pot_color,
+                            lod_pixels=round(10 * dpi) if lod else None)
+    metrics.count("trunk_points", sum(len(points) for points, _ in scene["trunks"]))
+    metrics.count("branch_segments", len(scene["branch_segments"]))
+    metrics.count("leaves", len(scene["leaves"][0]))
+    RENDER_BACKENDS[backend](scene, filename, dpi=dpi, context=context, writer=writer)
     print(f"Tree rendered to {filename}")
 
+GEN_PARAMS = dict(n=6, max_depth=3, base_step=14, angle_range=(-30, 30), length_range=(20, 40), node_budget=4000, segment_budget=None)
+
+
+def tree_seed(base_seed, index):
+    # independent stream per tree, stable no matter which worker renders it
+    return int(np.random.SeedSequence([base_seed, index]).generate_state(1)[0])
+
+
+def seed_tree(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+def grow_tree(seed, gen_params):
+    seed_tree(seed)
+    return generate_tree(**gen_params)
+
+
+def screen_skeleton(skeleton, seed, gen_params, limits, attempts=5):
+    # skeleton grew from seed; while it fails limits, regrow from seeds derived
+    # from it (stream 1 is the render seed, so retries start at 2). Every
+    # candidate's scores are noted for tuning; None if none passes.
+    retries = (grow_tree(tree_seed(seed, k), gen_params) for k in range(2, attempts + 1))
+    skeleton, candidates = first_passing(itertools.chain([skeleton], retries), limits)
+    metrics.note(candidates=candidates, rejected=skeleton is None)
+    return skeleton
+
+
+def tree_palette(render_seed):
+    palette_rng = random.Random(render_seed)
+    return palette_rng.choice(trunk_colors), palette_rng.choice(leaves_colors), palette_rng.choice(plant_pot_colors)
+
+
+def render_skeleton(skeleton, render_seed, palette, filename, trunk_main_width=60, trunk_min_width=1, dpi=300, backend="matplotlib", lod=False, writer=None):
+    trunks, buds, branches, leaves = skeleton
+    trunk_color, leaf_color, pot_color = palette
+    seed_tree(render_seed)
+    with metrics.stage("widths"):
+        trunk_width, branch_width = assign_path_widths(trunks, branches, trunk_main_width=trunk_main_width, trunk_min_width=trunk_min_width)
+    draw_tree_with_widths(trunks, trunk_width, branches, branch_width, buds=buds, leaves=leaves, filename=filename, trunk_color=trunk_color, leaf_color=leaf_color, pot_color=pot_color, dpi=dpi, backend=backend, lod=lod, writer=writer)
+    return filename
+
+
+def generate_and_render(index, base_seed, cache=None, gen_params=None, trunk_main_width=60, trunk_min_width=1, dpi=300, skeleton_outputs=(), backend="matplotlib", lod=False, limits=None, attempts=5):
+    gen_params = {**GEN_PARAMS, **(gen_params or {})}
+    seed = tree_seed(base_seed, index)
+    # colours and leaf noise get their own stream so a cached skeleton renders the same
+    render_seed = tree_seed(seed, 1)
+    suffix = RENDER_SUFFIXES[backend]
+    filename = f"pics/{str(index)}{suffix}"
+
+    palette = tree_palette(render_seed)
+
+    skeleton_key = cache_key("skeleton", seed, gen_params)
+    render_key = cache_key("render", skeleton_key, *palette,
+                           trunk_main_width, trunk_min_width, dpi, backend, lod, *([limits, attempts] if limits else []))
+    metrics.note(seed=seed)
+    rendered = cache is not None and cache.get_file(render_key, filename, suffix)
+    if rendered:
+        metrics.note(cached="render")
+        # the skeleton outputs are not cached, so a hit still needs the skeleton for them
+        if not skeleton_outputs:
+            return filename
+
+    skeleton = cache.get_object(skeleton_key) if cache is not None else None
+    if skeleton is None:
+        skeleton = grow_tree(seed, gen_params)
+        if cache is not None:
+            cache.put_object(skeleton_key, skeleton)
+    elif not rendered:
+        metrics.note(cached="skeleton")
+
+    # reject before paying for widths and drawing
+    if limits:
+        skeleton = screen_skeleton(skeleton, seed, gen_params, limits, attempts)
+        if skeleton is None:
+            print(f"Tree {index} rejected")
+            return None
+    write_skeleton_outputs(f"pics/ske_{str(index)}", skeleton, skeleton_outputs)
+    if rendered:
+        return filename
+
+    render_skeleton(skeleton, render_seed, palette, filename, trunk_main_width=trunk_main_width, trunk_min_width=trunk_min_width, dpi=dpi, backend=backend, lod=lod)
+    if cache is not None:
+        cache.put_file(render_key, filename, suffix)
+    return filename
+
+
+def warm_render_imports(backend="matplotlib"):
+    # scipy and the backend load lazily; loading them here keeps the first
+    # tree a worker renders from carrying them in its widths and draw stages
+    kdtree_class()
+    importlib.import_module(RENDER_MODULES[backend])
+
+
+def generate_and_render_with_metrics(index, trace_alloc=False, **kwargs):
+    warm_render_imports(kwargs.get("backend", "matplotlib"))
+    metrics.begin_tree(index=index, trace_alloc=trace_alloc)
+    try:
+        filename = generate_and_render(index, **kwargs)
+    finally:
+        record = metrics.end_tree()
+    return filename, record
+
+
+def run_batch(count, workers=1, base_seed=0, metrics_path=None, trace_alloc=False, **kwargs):
+    os.makedirs("pics", exist_ok=True)
+    if metrics_path is None:
+        job = partial(generate_and_render, base_seed=base_seed, **kwargs)
+    else:
+        job = partial(generate_and_render_with_metrics, base_seed=base_seed, trace_alloc=trace_alloc, **kwargs)
+    if workers <= 1:
+        results = [job(i) for i in range(count)]
+    else:
+        chunksize = max(1, count // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(job, range(count), chunksize=chunksize))
+
+    if metrics_path is None:
+        return results
+    filenames, records = zip(*results) if results else ((), ())
+    metrics.write_jsonl(records, metrics_path)
+    print(metrics.format_summary(metrics.summarize(records)))
+    return list(filenames)
+
+
 if __name__ == "__main__":
-    for i in range(50):
-        os.makedirs("pics", exist_ok=True)
-        cur_trunk_color, cur_leaf_color, cur_pot_color = \
-            random.choice(trunk_colors), random.choice(leaves_colors), random.choice(plant_pot_colors)
-        trunks, buds, branches, leaves = draw_random_trunk_curve(i)
-        trunk_width, branch_width = assign_path_widths(trunks, branches, trunk_main_width=60)
-        draw_tree_with_widths(trunks, trunk_width, branches, branch_width, buds=buds, leaves=leaves, filename=f"pics/{str(i)}.png", trunk_color=cur_trunk_color, leaf_color=cur_leaf_color, pot_color=cur_pot_color)
+    parser = argparse.ArgumentParser(description="Generate and render a batch of bonsai.")
+    parser.add_argument("--count", type=int, default=50, help="number of trees")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes")
+    parser.add_argument("--seed", type=int, default=None, help="base seed, random if omitted")
+    parser.add_argument("--dpi", type=float, default=300)
+    parser.add_argument("--backend", default="matplotlib", choices=sorted(RENDER_BACKENDS), help="renderer for the tree images")
+    parser.add_argument("--lod", action="store_true", help="drop trunk points and leaves too small to see at this dpi")
+    parser.add_argument("--max-depth", type=int, default=GEN_PARAMS["max_depth"], help="branching levels per branch tree")
+    parser.add_argument("--node-budget", type=int, default=GEN_PARAMS["node_budget"], help="most branch nodes per tree")
+    parser.add_argument("--skeleton-output", nargs="*", default=[], choices=sorted(SKELETON_OUTPUTS),
+                        help="debug skeleton files to write alongside each render")
+    parser.add_argument("--reject", action="store_true", help="score skeletons and regrow ones that fail the limits before rendering")
+    parser.add_argument("--limit", nargs="*", default=[], metavar="NAME=VALUE",
+                        help=f"override a rejection limit, implies --reject; defaults {' '.join(f'{k}={v}' for k, v in SCORE_LIMITS.items())}")
+    parser.add_argument("--attempts", type=int, default=5, help="trees grown per index before it is rejected")
+    parser.add_argument("--metrics", default=None, help="write per tree stage timings and counters to this JSONL file")
+    parser.add_argument("--trace-alloc", action="store_true", help="also record allocations per stage (slower)")
+    parser.add_argument("--cache-dir", default=None, help="reuse skeletons and renders from this directory")
+    parser.add_argument("--cache-size-mb", type=int, default=1024, help="evict least recently used entries past this size")
+    args = parser.parse_args()
+    try:
+        limits = parse_limits(args.limit) if args.reject or args.limit else None
+    except ValueError as e:
+        parser.error(str(e))
+
+    base_seed = args.seed if args.seed is not None else random.randrange(2**32)
+    print(f"Base seed {base_seed}")
+    cache = DiskCache(args.cache_dir, max_bytes=args.cache_size_mb << 20) if args.cache_dir else None
+    run_batch(args.count, workers=args.workers, base_seed=base_seed, cache=cache, dpi=args.dpi, backend=args.backend, lod=args.lod,
+              gen_params=dict(max_depth=args.max_depth, node_budget=args.node_budget),
+              skeleton_outputs=args.skeleton_output, metrics_path=args.metrics, trace_alloc=args.trace_alloc,
+              limits=limits, attempts=args.attempts)
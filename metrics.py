@@ -0,0 +1,138 @@
+import argparse
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+import numpy as np
+
+_record = None
+
+
+def begin_tree(trace_alloc=False, **fields):
+    # start collecting for one tree in this process; stages and counters
+    # recorded until end_tree land in it, and are no-ops when none is open
+    global _record
+    if trace_alloc and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _record = {**fields, "stages": {}, "counters": {}, "trace_alloc": trace_alloc, "start": time.perf_counter()}
+
+
+def end_tree():
+    global _record
+    record, _record = _record, None
+    if record is None:
+        return None
+    record["wall"] = time.perf_counter() - record.pop("start")
+    if record.pop("trace_alloc"):
+        tracemalloc.stop()
+    return record
+
+
+@contextmanager
+def stage(name):
+    # wall time and, with trace_alloc, net and peak bytes allocated. Stages
+    # are meant to be flat; a repeated name adds up.
+    record = _record
+    if record is None:
+        yield
+        return
+    tracing = record["trace_alloc"]
+    if tracing:
+        start_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        entry = record["stages"].setdefault(name, {"wall": 0.0})
+        entry["wall"] += time.perf_counter() - start
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            entry["alloc"] = entry.get("alloc", 0) + current - start_bytes
+            entry["peak"] = max(entry.get("peak", 0), peak - start_bytes)
+
+
+def count(name, value):
+    if _record is not None:
+        _record["counters"][name] = int(value)
+
+
+def note(**fields):
+    if _record is not None:
+        _record.update(fields)
+
+
+def write_jsonl(records, path):
+    with open(path, "w") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def read_jsonl(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _spread(values):
+    values = np.asarray(values, dtype=float)
+    return {
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "max": float(values.max()),
+    }
+
+
+def summarize(records, slowest=5):
+    # per stage and per tree wall time spread, plus the slowest trees with
+    # their counters, which is usually enough to tell what drives the tail
+    stages = {}
+    for record in records:
+        for name, entry in record["stages"].items():
+            stages.setdefault(name, []).append(entry["wall"])
+    # skeleton screening: how often each limit fails, to tune them against
+    screened = [r for r in records if "candidates" in r]
+    failed = {}
+    for r in screened:
+        for candidate in r["candidates"]:
+            for name in candidate["failed"]:
+                failed[name] = failed.get(name, 0) + 1
+    return {
+        "trees": len(records),
+        "wall": _spread([r["wall"] for r in records]) if records else None,
+        "stages": {name: {"trees": len(walls), "total": float(sum(walls)), **_spread(walls)}
+                   for name, walls in sorted(stages.items(), key=lambda item: -sum(item[1]))},
+        "slowest": [{key: r[key] for key in r if key not in ("stages", "candidates")}
+                    for r in sorted(records, key=lambda r: -r["wall"])[:slowest]],
+        "screening": {
+            "trees": len(screened),
+            "candidates": sum(len(r["candidates"]) for r in screened),
+            "rejected": sum(bool(r.get("rejected")) for r in screened),
+            "failed": dict(sorted(failed.items(), key=lambda item: -item[1])),
+        } if screened else None,
+    }
+
+
+def format_summary(summary):
+    lines = [f"{summary['trees']} trees"]
+    if summary["wall"]:
+        w = summary["wall"]
+        lines.append(f"  per tree      mean {w['mean'] * 1e3:8.1f}ms  p95 {w['p95'] * 1e3:8.1f}ms  max {w['max'] * 1e3:8.1f}ms")
+    for name, s in summary["stages"].items():
+        lines.append(f"  {name:<13} mean {s['mean'] * 1e3:8.1f}ms  p95 {s['p95'] * 1e3:8.1f}ms  total {s['total']:7.2f}s")
+    if summary.get("screening"):
+        s = summary["screening"]
+        failed = " ".join(f"{k}={v}" for k, v in s["failed"].items())
+        lines.append(f"  screening     {s['candidates']} candidates for {s['trees']} trees, {s['rejected']} rejected; failed {failed or 'none'}")
+    for r in summary["slowest"]:
+        counters = " ".join(f"{k}={v}" for k, v in r["counters"].items())
+        lines.append(f"  slow tree {r.get('index')}: {r['wall'] * 1e3:.1f}ms {counters}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a metrics JSONL file.")
+    parser.add_argument("path")
+    parser.add_argument("--slowest", type=int, default=5)
+    args = parser.parse_args()
+    print(format_summary(summarize(read_jsonl(args.path), slowest=args.slowest)))
@@ -0,0 +1,125 @@
+import argparse
+import itertools
+import os
+import queue
+import random
+import threading
+from generate import iter_trees
+from main import GEN_PARAMS, RENDER_BACKENDS, RENDER_SUFFIXES, render_skeleton, screen_skeleton, tree_palette, tree_seed
+from recur import SKELETON_OUTPUTS, write_skeleton_outputs
+from scoring import parse_limits, SCORE_LIMITS
+
+
+class BackgroundWriter:
+    # PNG encoding and file writes on a few threads while the caller draws the
+    # next tree. Jobs with the same key run in order on one thread, and each
+    # thread's queue is bounded, so a caller that outruns the disk waits
+    # instead of piling up images.
+    def __init__(self, threads=2, max_pending=2):
+        self.error = None
+        self.queues = [queue.Queue(maxsize=max_pending) for _ in range(threads)]
+        self.threads = [threading.Thread(target=self._run, args=(jobs,), daemon=True) for jobs in self.queues]
+        for thread in self.threads:
+            thread.start()
+
+    def _run(self, jobs):
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            fn, args, kwargs = job
+            # after a failure keep draining, so submit never blocks on a dead thread
+            if self.error is None:
+                try:
+                    fn(*args, **kwargs)
+                except BaseException as e:
+                    self.error = e
+
+    def _raise(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def submit(self, key, fn, *args, **kwargs):
+        self._raise()
+        self.queues[hash(key) % len(self.queues)].put((fn, args, kwargs))
+
+    def close(self):
+        # waits for every queued job; a job that failed is raised here if
+        # submit has not raised it already
+        for jobs in self.queues:
+            jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+        self._raise()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def render_stream(seeds, out_dir="pics", names=None, gen_params=None, trunk_main_width=60, trunk_min_width=1, dpi=300,
+                  backend="matplotlib", lod=False, skeleton_outputs=(), writer=None, limits=None, attempts=5):
+    # generate lazily, render here and leave encoding and writes to writer.
+    # Yields each filename as soon as it is queued; every file is on disk once
+    # the stream is exhausted or closed. Trees match main.py for the same seeds,
+    # including which ones limits reject; those get no file.
+    os.makedirs(out_dir, exist_ok=True)
+    names = itertools.count() if names is None else names
+    suffix = RENDER_SUFFIXES[backend]
+    own_writer = writer is None
+    writer = writer or BackgroundWriter()
+    try:
+        for name, (seed, skeleton) in zip(names, iter_trees(seeds, gen_params)):
+            if limits:
+                skeleton = screen_skeleton(skeleton, seed, {**GEN_PARAMS, **(gen_params or {})}, limits, attempts)
+                if skeleton is None:
+                    print(f"Tree {name} rejected")
+                    continue
+            if skeleton_outputs:
+                basename = os.path.join(out_dir, f"ske_{name}")
+                writer.submit(basename, write_skeleton_outputs, basename, skeleton, skeleton_outputs)
+            render_seed = tree_seed(seed, 1)
+            filename = os.path.join(out_dir, f"{name}{suffix}")
+            yield render_skeleton(skeleton, render_seed, tree_palette(render_seed), filename, trunk_main_width=trunk_main_width,
+                                  trunk_min_width=trunk_min_width, dpi=dpi, backend=backend, lod=lod, writer=writer)
+    finally:
+        if own_writer:
+            writer.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate and render bonsai as a stream, writing files in the background.")
+    parser.add_argument("--count", type=int, default=50, help="number of trees, 0 to run until interrupted")
+    parser.add_argument("--seed", type=int, default=None, help="base seed, random if omitted")
+    parser.add_argument("-o", "--out-dir", default="pics")
+    parser.add_argument("--dpi", type=float, default=300)
+    parser.add_argument("--backend", default="matplotlib", choices=sorted(RENDER_BACKENDS), help="renderer for the tree images")
+    parser.add_argument("--lod", action="store_true", help="drop trunk points and leaves too small to see at this dpi")
+    parser.add_argument("--max-depth", type=int, default=GEN_PARAMS["max_depth"], help="branching levels per branch tree")
+    parser.add_argument("--node-budget", type=int, default=GEN_PARAMS["node_budget"], help="most branch nodes per tree")
+    parser.add_argument("--skeleton-output", nargs="*", default=[], choices=sorted(SKELETON_OUTPUTS),
+                        help="debug skeleton files to write alongside each render")
+    parser.add_argument("--reject", action="store_true", help="score skeletons and regrow ones that fail the limits before rendering")
+    parser.add_argument("--limit", nargs="*", default=[], metavar="NAME=VALUE",
+                        help=f"override a rejection limit, implies --reject; defaults {' '.join(f'{k}={v}' for k, v in SCORE_LIMITS.items())}")
+    parser.add_argument("--attempts", type=int, default=5, help="trees grown per index before it is rejected")
+    parser.add_argument("--write-threads", type=int, default=2, help="threads encoding and writing files")
+    parser.add_argument("--max-pending", type=int, default=2, help="queued files per write thread before rendering waits")
+    args = parser.parse_args()
+    try:
+        limits = parse_limits(args.limit) if args.reject or args.limit else None
+    except ValueError as e:
+        parser.error(str(e))
+
+    base_seed = args.seed if args.seed is not None else random.randrange(2**32)
+    print(f"Base seed {base_seed}")
+    indices = range(args.count) if args.count else itertools.count()
+    seeds = (tree_seed(base_seed, i) for i in indices)
+    with BackgroundWriter(threads=args.write_threads, max_pending=args.max_pending) as writer:
+        for _ in render_stream(seeds, out_dir=args.out_dir, gen_params=dict(max_depth=args.max_depth, node_budget=args.node_budget),
+                               dpi=args.dpi, backend=args.backend, lod=args.lod, skeleton_outputs=args.skeleton_output, writer=writer,
+                               limits=limits, attempts=args.attempts):
+            pass
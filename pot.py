@@ -1,16 +1,37 @@
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-from matplotlib.path import Path
-from matplotlib.patches import PathPatch
+import numpy as np
+
+SOIL_LINEWIDTH = 3
+
 
 def draw_plant_pot(ax, root_x, root_y, pot_width=140, pot_height=30, pot_color=None):
+    import matplotlib.patches as patches
+
     top_width = pot_width
     draw_rounded_trapezoid(ax, root_x, root_y - 30, top_width=100, bottom_width=140, height=30, radius=10, color=pot_color)
 
-    soil = patches.Arc((root_x, root_y), top_width * 0.75, 25   , theta1=0, theta2=180, color=pot_color, lw=3)
+    soil = patches.Arc((root_x, root_y), top_width * 0.75, 25   , theta1=0, theta2=180, color=pot_color, lw=SOIL_LINEWIDTH)
     ax.add_patch(soil)
 
-def draw_rounded_trapezoid(ax, root_x, root_y, top_width=140, bottom_width=100, height=30, radius=10, color='peru'):
+def plant_pot_bounds(root_x, root_y):
+    # (xmin, ymin, xmax, ymax) of what draw_plant_pot draws
+    return (root_x - 70, root_y - 30, root_x + 70, root_y + 25 / 2)
+
+def plant_pot_shapes(root_x, root_y, pot_width=140, steps=16):
+    # the same pot as draw_plant_pot, flattened for backends without Bezier paths
+    body = rounded_trapezoid_outline(root_x, root_y - 30, top_width=100, bottom_width=140, height=30, steps=steps)
+    theta = np.linspace(0, np.pi, steps * 2)
+    soil = np.column_stack([root_x + pot_width * 0.75 / 2 * np.cos(theta), root_y + 25 / 2 * np.sin(theta)])
+    return body, soil
+
+def plant_pot_top(root_x, root_y, pot_width=140, steps=16):
+    # the pot's upper edge left to right as a polyline: the rim at root_y out
+    # to the body's corners and the soil dome between
+    _, soil = plant_pot_shapes(root_x, root_y, pot_width, steps)
+    xs = np.concatenate([[root_x - 70], soil[::-1, 0], [root_x + 70]])
+    ys = np.concatenate([[root_y], soil[::-1, 1], [root_y]])
+    return xs, ys
+
+def rounded_trapezoid_verts(root_x, root_y, top_width=140, bottom_width=100, height=30):
     half_top = top_width / 2
     half_bottom = bottom_width / 2
 
@@ -22,7 +43,7 @@ def draw_rounded_trapezoid(ax, root_x, root_y, top_width=140, bottom_width=100,
     ctrl_offset_x = (half_top - half_bottom) * 0.8
     ctrl_offset_y = height * 0.5
 
-    verts = [
+    return [
         top_left,                                                    
         top_right,                                                  
         (top_right[0] - ctrl_offset_x, top_right[1] + ctrl_offset_y),  
@@ -32,6 +53,22 @@ def draw_rounded_trapezoid(ax, root_x, root_y, top_width=140, bottom_width=100,
         top_left
     ]
 
+def rounded_trapezoid_outline(root_x, root_y, top_width=140, bottom_width=100, height=30, steps=16):
+    top_left, top_right, ctrl_right, bottom_right, bottom_left, ctrl_left, _ = \
+        np.asarray(rounded_trapezoid_verts(root_x, root_y, top_width, bottom_width, height))
+    t = np.linspace(0, 1, steps)[:, None]
+
+    def quad(p0, p1, p2):
+        return (1 - t) ** 2 * p0 + 2 * (1 - t) * t * p1 + t ** 2 * p2
+
+    return np.concatenate([[top_left], quad(top_right, ctrl_right, bottom_right), quad(bottom_left, ctrl_left, top_left)])
+
+def draw_rounded_trapezoid(ax, root_x, root_y, top_width=140, bottom_width=100, height=30, radius=10, color='peru'):
+    from matplotlib.path import Path
+    from matplotlib.patches import PathPatch
+
+    verts = rounded_trapezoid_verts(root_x, root_y, top_width, bottom_width, height)
+
     codes = [
         Path.MOVETO,     # top_left
         Path.LINETO,     # top_right
@@ -44,4 +81,4 @@ def draw_rounded_trapezoid(ax, root_x, root_y, top_width=140, bottom_width=100,
 
     path = Path(verts, codes)
     patch = PathPatch(path, facecolor=color, edgecolor='none')
-    ax.add_patch(patch)
\ No newline at end of file
+    ax.add_patch(patch)
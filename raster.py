@@ -0,0 +1,129 @@
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw
+import metrics
+from pot import plant_pot_shapes, SOIL_LINEWIDTH
+from scene import view_limits
+from sprites import blit_leaves
+
+LEAF_ALPHA = 0.8
+
+
+class Raster:
+    # final-size RGB image in data coordinates. Solid shapes are queued and
+    # drawn into a supersampled coverage mask cropped to their extent, which
+    # is box-filtered down and composited in one go per colour layer. Leaves
+    # are blitted straight onto the image from pre-antialiased sprites.
+    def __init__(self, limits, pixels, dpi, supersample=2):
+        self.xmin, self.xmax, self.ymin, self.ymax = limits
+        self.pixels = pixels
+        self.supersample = supersample
+        self.scale = pixels * supersample / (self.xmax - self.xmin)
+        self.points_to_pixels = dpi / 72 * supersample
+        self.image = Image.new("RGB", (pixels, pixels), (255, 255, 255))
+        self.shapes = []
+
+    def to_pixels(self, points):
+        # supersampled pixel coordinates
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        return np.column_stack([(points[:, 0] - self.xmin) * self.scale, (self.ymax - points[:, 1]) * self.scale])
+
+    def polygon(self, points):
+        self.shapes.append(("polygon", self.to_pixels(points).reshape(1, -1)))
+
+    def segments(self, segments, widths, cap="round"):
+        # each segment becomes a quad of its own width; round caps add a disc
+        # at both ends, projecting caps stretch the quad by half a width
+        segments = np.asarray(segments, dtype=float).reshape(-1, 2, 2)
+        widths = np.broadcast_to(np.asarray(widths, dtype=float), (len(segments),))
+        # zero-width lines draw nothing in matplotlib but still fill a pixel here
+        segments, widths = segments[widths > 0], widths[widths > 0]
+        if len(segments) == 0:
+            return
+        p0 = self.to_pixels(segments[:, 0])
+        p1 = self.to_pixels(segments[:, 1])
+        half = widths[:, None] * self.points_to_pixels / 2
+
+        d = p1 - p0
+        length = np.hypot(d[:, 0], d[:, 1])[:, None]
+        u = np.divide(d, length, out=np.zeros_like(d), where=length > 0)
+        n = np.column_stack([-u[:, 1], u[:, 0]]) * half
+        if cap == "projecting":
+            p0, p1 = p0 - u * half, p1 + u * half
+        quads = np.stack([p0 + n, p1 + n, p1 - n, p0 - n], axis=1)
+        self.shapes.append(("polygon", quads.reshape(len(quads), -1)))
+        if cap == "round":
+            ends = np.concatenate([p0, p1])
+            radii = np.concatenate([half, half])
+            self.shapes.append(("ellipse", np.column_stack([ends - radii, ends + radii])))
+
+    def polyline(self, points, width, cap="round"):
+        points = np.asarray(points, dtype=float)
+        self.segments(np.stack([points[:-1], points[1:]], axis=1), width, cap=cap)
+
+    def fill(self, color):
+        # composite everything queued since the last fill as one solid layer
+        shapes, self.shapes = self.shapes, []
+        if not shapes:
+            return
+        ss = self.supersample
+        corners = np.concatenate([coords.reshape(-1, 2) for _, coords in shapes])
+        x0, y0 = np.maximum(np.floor(corners.min(axis=0) / ss), 0).astype(int)
+        x1, y1 = np.minimum(np.ceil(corners.max(axis=0) / ss), self.pixels).astype(int)
+        if x1 <= x0 or y1 <= y0:
+            return
+
+        mask = Image.new("L", (int(x1 - x0) * ss, int(y1 - y0) * ss), 0)
+        draw = ImageDraw.Draw(mask)
+        shift = np.array([x0, y0], dtype=float) * ss
+        for kind, coords in shapes:
+            shape = draw.polygon if kind == "polygon" else draw.ellipse
+            for row in (coords.reshape(len(coords), -1, 2) - shift).reshape(len(coords), -1).tolist():
+                shape(row, fill=255)
+        if ss > 1:
+            mask = mask.reduce(ss)
+        self.image.paste(ImageColor.getrgb(color)[:3], (int(x0), int(y0)), mask)
+
+    def leaves(self, offsets, widths, heights, angles, colors, alpha=1.0, outline_points=0, atlas=None):
+        # outline_points grows every leaf like a matplotlib edge of that width would
+        if len(offsets) == 0:
+            return
+        ss = self.supersample
+        grow = outline_points * self.points_to_pixels
+        blit_leaves(self.image, self.to_pixels(offsets) / ss, (np.asarray(widths) * self.scale + grow) / ss,
+                    (np.asarray(heights) * self.scale + grow) / ss, np.asarray(angles), np.asarray(colors),
+                    alpha=alpha, atlas=atlas)
+
+    def save(self, filename, compress_level=3, writer=None):
+        if writer is None:
+            self.image.save(filename, compress_level=compress_level)
+        else:
+            writer.submit(filename, self.image.save, filename, compress_level=compress_level)
+        return self.image
+
+
+def render_scene(scene, filename, dpi=300, size=10, margin=0.1, supersample=None, compress_level=3, writer=None):
+    pixels = int(round(size * dpi))
+    if supersample is None:
+        supersample = 4 if pixels <= 512 else 2
+    limits = view_limits(scene["bounds"], scene["pad_points"], size, margin)
+    raster = Raster(limits, pixels, dpi, supersample)
+
+    # same stacking as the matplotlib backend: pot, branches, leaves, then trunks
+    with metrics.stage("pot"):
+        body, soil = plant_pot_shapes(*scene["pot_origin"])
+        raster.polygon(body)
+        raster.polyline(soil, SOIL_LINEWIDTH, cap="butt")
+        raster.fill(scene["pot_color"])
+
+    with metrics.stage("branches"):
+        raster.segments(scene["branch_segments"], scene["branch_widths"], cap="projecting")
+        raster.fill(scene["trunk_color"])
+    with metrics.stage("canopy"):
+        raster.leaves(*scene["leaves"], alpha=LEAF_ALPHA, outline_points=1)
+    with metrics.stage("trunk"):
+        for points, widths in scene["trunks"]:
+            raster.polyline(points, widths[:-1], cap="round")
+        raster.fill(scene["trunk_color"])
+
+    with metrics.stage("png"):
+        return raster.save(filename, compress_level=compress_level, writer=writer)
@@ -1,19 +1,15 @@
 import random
 import math
+import threading
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.interpolate import splprep, splev
+import metrics
+from forest import ForestBuilder, as_forest
+from trunks import generate_trunk_curves, tangent_angles, bud_candidates
 from util import export_tree_to_json
 
-all_trunk_segments = []
-all_branch_trees = []
-all_leaves = []
-
-
-def grow_branch_tree_list(start_pos, angle, depth, ratio, is_top_branch, max_depth=3, base_step=14, angle_range=(-30, 30)):
-    if depth > max_depth:
-        return None
 
+def grow_branch_node(start_pos, angle, depth, ratio, is_top_branch, base_step=14, rng=None):
+    rng = random if rng is None else rng
     x, y = start_pos
     current_angle = angle
     points = [(x, y)]
@@ -23,7 +19,7 @@ def grow_branch_tree_list(start_pos, angle, depth, ratio, is_top_branch, max_dep
         # crown type
         scale = 0.1
         is_crown = True
-        current_angle = 90 + random.uniform(-20, 20)
+        current_angle = 90 + rng.uniform(-20, 20)
 
     else:
         # the further the shorter
@@ -31,152 +27,143 @@ def grow_branch_tree_list(start_pos, angle, depth, ratio, is_top_branch, max_dep
     
     local_step_range = (base_step * 0.5 * scale, base_step * 1.0 * scale)
 
-    n_segments = random.randint(2, 4) if not is_crown else 1
+    n_segments = rng.randint(2, 4) if not is_crown else 1
     for _ in range(n_segments):
-        step = random.uniform(*local_step_range)
+        step = rng.uniform(*local_step_range)
         rad = math.radians(current_angle)
         x += step * math.cos(rad)
         y += step * math.sin(rad)
         points.append((x, y))
-        current_angle += random.uniform(-10, 10)
+        current_angle += rng.uniform(-10, 10)
 
-    node = {
-        "points": [[float(px), float(py)] for px, py in points],
-        "children": []
-    }
+    return points, current_angle, is_crown
 
+def branch_children(points, current_angle, is_crown, angle_range=(-30, 30), rng=None):
+    rng = random if rng is None else rng
+    children = []
     for i in range(len(points) - 2, len(points)):
-        if depth < max_depth and (i == len(points) - 1 or random.random() < 0.3):
+        if i == len(points) - 1 or rng.random() < 0.3:
             if is_crown:
-                branch_count = random.randint(2, 3)
+                branch_count = rng.randint(2, 3)
             else:
-                branch_count = random.randint(1, 2)
+                branch_count = rng.randint(1, 2)
 
             
             for _ in range(branch_count):
                 if is_crown:
-                    branch_angle = random.randint(0, 180) + random.uniform(*angle_range)
+                    branch_angle = rng.randint(0, 180) + rng.uniform(*angle_range)
                 else:
-                    branch_angle = current_angle + random.uniform(*angle_range)
-                child = grow_branch_tree_list(points[i], branch_angle, depth + 1, 0, False, max_depth, base_step, angle_range)
-                if child:
-                    node["children"].append(child)
-
-    return node
-
-def generate_trunk_curve(n=6, start_pos=(0, 0), start_angle=90, length_range=(20, 40)):
-    ctrl_x = [start_pos[0]]
-    ctrl_y = [start_pos[1]]
-    angle = start_angle
-    total_angle_change = 0
-
-    for i in range(1, n):
-        if i == 1:
-            delta_angle = random.uniform(-30, 30)
-        else:
-            balance_bias = -0.2 * total_angle_change
-            delta_angle = random.uniform(-40, 40) + balance_bias * 0.5
-        angle += delta_angle
-
-        length = random.uniform(*length_range)
-        dx = math.cos(math.radians(angle)) * length
-        dy = math.sin(math.radians(angle)) * length
-        if i == 1 and dy < 10:
-            dy = 10 + abs(dy)
-
-        ctrl_x.append(ctrl_x[-1] + dx)
-        ctrl_y.append(ctrl_y[-1] + dy)
-
-        if i >= 2:
-            dx1 = ctrl_x[-2] - ctrl_x[-3]
-            dy1 = ctrl_y[-2] - ctrl_y[-3]
-            ang1 = math.atan2(dy1, dx1)
-            ang2 = math.atan2(dy, dx)
-            dtheta = math.degrees(ang2 - ang1)
-            while dtheta > 180: dtheta -= 360
-            while dtheta < -180: dtheta += 360
-            total_angle_change += dtheta
-
-    if len(ctrl_x) < 2:
-        return np.array([]), np.array([])
+                    branch_angle = current_angle + rng.uniform(*angle_range)
+                children.append((points[i], branch_angle))
+    return children
+
+def polyline_length(points):
+    pts = np.asarray(points, dtype=float)
+    return float(np.hypot(*np.diff(pts, axis=0).T).sum())
+
+def grow_branch_forest(builder, seeds, max_depth=3, base_step=14, angle_range=(-30, 30), node_budget=None, segment_budget=None, rng=None):
+    # seeds are (start_pos, angle, depth, ratio, is_top_branch). The whole tree
+    # grows one level at a time from a worklist; once a level would overrun the
+    # node or segment budget its shortest branches are dropped, along with
+    # everything they would have grown.
+    level = [(start_pos, angle, depth, ratio, is_top_branch, -1)
+             for start_pos, angle, depth, ratio, is_top_branch in seeds if depth <= max_depth]
+    nodes = segments = 0
+    roots = []
+    exhausted = False
+    while level:
+        grown = [grow_branch_node(start_pos, angle, depth, ratio, is_top_branch, base_step, rng)
+                 for start_pos, angle, depth, ratio, is_top_branch, _ in level]
+
+        node_room = None if node_budget is None else node_budget - nodes
+        segment_room = None if segment_budget is None else segment_budget - segments
+        level_segments = sum(len(points) - 1 for points, _, _ in grown)
+        if (node_room is not None and len(grown) > node_room) or (segment_room is not None and level_segments > segment_room):
+            keep = []
+            used = 0
+            for k in sorted(range(len(grown)), key=lambda k: -polyline_length(grown[k][0])):
+                n_seg = len(grown[k][0]) - 1
+                if node_room is not None and len(keep) >= node_room:
+                    break
+                if segment_room is not None and used + n_seg > segment_room:
+                    continue
+                keep.append(k)
+                used += n_seg
+            keep = sorted(keep)
+            level = [level[k] for k in keep]
+            grown = [grown[k] for k in keep]
+            exhausted = True
+
+        next_level = []
+        for (_, _, depth, _, _, parent), (points, current_angle, is_crown) in zip(level, grown):
+            index = builder.add(points, parent, depth - 1)
+            nodes += 1
+            segments += len(points) - 1
+            if parent < 0:
+                roots.append(index)
+            if depth < max_depth and not exhausted:
+                for child_pos, child_angle in branch_children(points, current_angle, is_crown, angle_range, rng):
+                    next_level.append((child_pos, child_angle, depth + 1, 0, False, index))
+        level = next_level
+        if node_budget is not None and nodes >= node_budget:
+            break
+
+    return roots
+
+def grow_branch_tree(builder, start_pos, angle, depth, ratio, is_top_branch, max_depth=3, base_step=14, angle_range=(-30, 30)):
+    roots = grow_branch_forest(builder, [(start_pos, angle, depth, ratio, is_top_branch)], max_depth, base_step, angle_range)
+    return roots[0] if roots else None
+
+def grow_branch_tree_list(start_pos, angle, depth, ratio, is_top_branch, max_depth=3, base_step=14, angle_range=(-30, 30)):
+    builder = ForestBuilder()
+    if grow_branch_tree(builder, start_pos, angle, depth, ratio, is_top_branch, max_depth, base_step, angle_range) is None:
+        return None
+    return builder.build().to_trees()[0]
 
-    k = min(3, len(ctrl_x) - 1)
-    tck, u = splprep([ctrl_x, ctrl_y], s=0, k=k)
-    u_fine = np.linspace(0, 1, 150)
-    return splev(u_fine, tck)
+def generate_trunk_curve(n=6, start_pos=(0, 0), start_angle=90, length_range=(20, 40), np_rng=None):
+    if n < 2:
+        return np.array([]), np.array([])
+    xs, ys = generate_trunk_curves(1, n, start_pos, start_angle, length_range, rng=np_rng)
+    return xs[0], ys[0]
 
-def generate_feedback_trunk_with_buds(n=6, start_pos=(0, 0), start_angle=90, length_range=(20, 40)):
-    global all_trunk_segments
+def generate_feedback_trunk_with_buds(n=6, start_pos=(0, 0), start_angle=90, length_range=(20, 40), trunk_segments=None, rng=None, np_rng=None):
+    # rng and np_rng default to the global random and numpy generators
+    rng = random if rng is None else rng
+    if trunk_segments is None:
+        trunk_segments = []
 
-    
-    ctrl_x = [start_pos[0]]
-    ctrl_y = [start_pos[1]]
-    angle = start_angle
-    total_angle_change = 0
-
-    for i in range(1, n):
-        if i == 1:
-            delta_angle = random.uniform(-30, 30)
-        else:
-            balance_bias = -0.2 * total_angle_change
-            delta_angle = random.uniform(-40, 40) + balance_bias * 0.5
-        angle += delta_angle
-
-        length = random.uniform(*length_range)
-        dx = math.cos(math.radians(angle)) * length
-        dy = math.sin(math.radians(angle)) * length
-        if i == 1 and dy < 10:
-            dy = 10 + abs(dy)
-
-        ctrl_x.append(ctrl_x[-1] + dx)
-        ctrl_y.append(ctrl_y[-1] + dy)
-
-        if i >= 2:
-            dx1 = ctrl_x[-2] - ctrl_x[-3]
-            dy1 = ctrl_y[-2] - ctrl_y[-3]
-            ang1 = math.atan2(dy1, dx1)
-            ang2 = math.atan2(dy, dx)
-            dtheta = math.degrees(ang2 - ang1)
-            while dtheta > 180: dtheta -= 360
-            while dtheta < -180: dtheta += 360
-            total_angle_change += dtheta
-
-    if len(ctrl_x) < 2:
+    if n < 2:
         return [], [], []
-    k = min(3, len(ctrl_x) - 1)
-    tck, u = splprep([ctrl_x, ctrl_y], s=0, k=k)
-    u_fine = np.linspace(0, 1, 150)
-    x_vals, y_vals = splev(u_fine, tck)
+    x_vals, y_vals = generate_trunk_curve(n, start_pos, start_angle, length_range, np_rng)
+    tangents = tangent_angles(x_vals, y_vals)[0]
 
     buds = []
 
-    grow_limit = random.randint(3, 6)
+    grow_limit = rng.randint(3, 6)
     grow_count = 0
-    sub_trunk_limit = random.randint(1, 2)
+    sub_trunk_limit = rng.randint(1, 2)
     sub_trunk_count = 0
     last_grow_pos = None
 
     min_dist_between_grows = len(x_vals) // (grow_limit + 1)
 
-    for i in range(len(x_vals) - 2, 4, -10):
+    for i in bud_candidates(len(x_vals), 10).tolist():
         x, y = x_vals[i], y_vals[i]
-        dx = x_vals[i+1] - x_vals[i-1]
-        dy = y_vals[i+1] - y_vals[i-1]
-        angle = math.degrees(math.atan2(dy, dx))
+        angle = tangents[i]
 
         fate = None
         ratio = float(i / len(x_vals))
         if grow_count < grow_limit:
             if last_grow_pos is None or last_grow_pos - i >= min_dist_between_grows:
-                if random.random() < 0.6:
+                if rng.random() < 0.6:
                     fate = 'grow'
                     grow_count += 1
                     last_grow_pos = i
-        fate = random.choices(['flower', 'dormant', 'abort'], [0.1, 0.7, 0.2])[0] if fate == None else fate
+        fate = rng.choices(['flower', 'dormant', 'abort'], [0.1, 0.7, 0.2])[0] if fate == None else fate
             
         buds.append({ 'pos': (x, y), 'angle': angle, 'fate': fate , 'ratio': ratio})
         if fate == 'grow':
-            if random.random() < 0.8 and sub_trunk_count < sub_trunk_limit and ratio < 0.6:
+            if rng.random() < 0.8 and sub_trunk_count < sub_trunk_limit and ratio < 0.6:
                 
                 # the further the shorter
                 remaining = (i / len(x_vals))  
@@ -184,123 +171,174 @@ def generate_feedback_trunk_with_buds(n=6, start_pos=(0, 0), start_angle=90, len
                 sub_x, sub_y = generate_trunk_curve(
                     n=sub_n,
                     start_pos=(x, y),
-                    start_angle=angle + random.uniform(-40, 40),
-                    length_range=(20, 40)
+                    start_angle=angle + rng.uniform(-40, 40),
+                    length_range=length_range,
+                    np_rng=np_rng
                 )
                 if len(sub_x) > 0 and len(sub_y) > 0:
                     if len(sub_x) > 0:
-                        all_trunk_segments.append((sub_x, sub_y))
+                        trunk_segments.append((sub_x, sub_y))
 
                         sub_buds = []
-                        sub_grow_limit = random.randint(0, 3)
+                        sub_grow_limit = rng.randint(0, 3)
                         sub_grow_count = 0
                         last_sub_grow_pos = None
                         min_sub_dist = len(sub_x) // (sub_grow_limit + 1)
 
-                        for j in range(len(sub_x) - 2, 4, -20):
+                        sub_tangents = tangent_angles(sub_x, sub_y)[0]
+                        for j in bud_candidates(len(sub_x), 20).tolist():
                             sx, sy = sub_x[j], sub_y[j]
-                            sdx = sub_x[j+1] - sub_x[j-1]
-                            sdy = sub_y[j+1] - sub_y[j-1]
-                            s_angle = math.degrees(math.atan2(sdy, sdx))
+                            s_angle = sub_tangents[j]
 
                             sub_fate = None
                             if sub_grow_count < sub_grow_limit:
                                 if last_sub_grow_pos is None or last_sub_grow_pos - j >= min_sub_dist:
-                                    if random.random() < 0.6:
+                                    if rng.random() < 0.6:
                                         sub_fate = 'grow'
                                         sub_grow_count += 1
                                         last_sub_grow_pos = j
-                            sub_fate = random.choices(['flower', 'dormant', 'abort'], [0.1, 0.7, 0.2])[0] if sub_fate is None else sub_fate
+                            sub_fate = rng.choices(['flower', 'dormant', 'abort'], [0.1, 0.7, 0.2])[0] if sub_fate is None else sub_fate
                             sub_buds.append({ 'pos': (sx, sy), 'angle': s_angle, 'fate': sub_fate, 'ratio': float(j / len(sub_x))})
 
                         buds.extend(sub_buds)
                     sub_trunk_count += 1
-            elif random.random() < 0.5:
+            elif rng.random() < 0.5:
                 
                 # double fork
                 buds.append({ 'pos': (x, y), 'angle': angle, 'fate': fate, 'ratio': ratio})
 
-    all_trunk_segments.append((x_vals, y_vals))
+    trunk_segments.append((x_vals, y_vals))
     return x_vals, y_vals, buds
 
-def draw_random_trunk_curve(filename):
-    global all_trunk_segments, all_branch_trees, all_leaves
-    all_trunk_segments = []
-    all_branch_trees = []
-    all_leaves = []
-
-    # generate the main trunk here
-    x_vals, y_vals, all_buds = generate_feedback_trunk_with_buds(n=6)
-
-    # grow branches
-    for bud in all_buds:
+def branch_seeds(buds, rng=None):
+    rng = random if rng is None else rng
+    seeds = []
+    for bud in buds:
         if bud['fate'] == 'grow':
             
             # almost horizontal
-            base_angle = bud['angle'] + random.choice([-90, 90])  # 垂线方向
-            jitter = random.uniform(-40, 40)
+            base_angle = bud['angle'] + rng.choice([-90, 90])  # 垂线方向
+            jitter = rng.uniform(-40, 40)
             side_angle = base_angle + jitter
 
             if 210 <= side_angle <= 340:
-                side_angle = random.randint(20, 160) + jitter
+                side_angle = rng.randint(20, 160) + jitter
 
-            branch_tree = grow_branch_tree_list(
-                start_pos=bud['pos'],
-                angle=side_angle,
-                depth=1,
-                max_depth=3,
-                ratio=bud['ratio'],
-                is_top_branch=True
-            )
-            if branch_tree:
-                all_branch_trees.append(branch_tree)
+            seeds.append((bud['pos'], side_angle, 1, bud['ratio'], True))
+    return seeds
 
 
-    plt.figure(figsize=(8, 8))
+def generate_tree(n=6, max_depth=3, base_step=14, angle_range=(-30, 30), length_range=(20, 40), node_budget=None, segment_budget=None, rng=None, np_rng=None):
+    trunk_segments = []
+    branches = ForestBuilder()
+    leaves = []
 
-    for (x, y) in all_trunk_segments:
-        plt.plot(x, y, color='sienna', linewidth=1.5)
+    # generate the main trunk here
+    with metrics.stage("grow_trunks"):
+        x_vals, y_vals, buds = generate_feedback_trunk_with_buds(n=n, length_range=length_range, trunk_segments=trunk_segments, rng=rng, np_rng=np_rng)
 
-    plt.plot(x_vals[0], y_vals[0], marker='s', color='blue', markersize=6, label='Start Point')
+    # grow branches
+    with metrics.stage("grow_branches"):
+        grow_branch_forest(branches, branch_seeds(buds, rng), max_depth=max_depth, base_step=base_step, angle_range=angle_range,
+                           node_budget=node_budget, segment_budget=segment_budget, rng=rng)
+        forest = branches.build()
+
+    metrics.count("trunks", len(trunk_segments))
+    metrics.count("buds", len(buds))
+    metrics.count("branch_roots", len(forest))
+    metrics.count("branch_nodes", forest.node_count)
+    return trunk_segments[::-1], buds[::-1], forest, leaves[::-1]
+
+
+class TreeGenerator:
+    # grows trees from its own random streams and no module state, so separate
+    # generators can run on separate threads; the lock lets threads share one.
+    # generate(seed) gives the same tree as seeding the global generators with
+    # seed and calling generate_tree.
+    def __init__(self, seed=None, **params):
+        self.params = params
+        self.rng = random.Random()
+        self.np_rng = np.random.RandomState()
+        self.lock = threading.RLock()
+        if seed is not None:
+            self.seed(seed)
+
+    def seed(self, seed):
+        with self.lock:
+            self.rng.seed(seed)
+            self.np_rng.seed(seed)
+
+    def generate(self, seed=None):
+        # without a seed, the next tree from where the streams left off
+        with self.lock:
+            if seed is not None:
+                self.seed(seed)
+            return generate_tree(**self.params, rng=self.rng, np_rng=self.np_rng)
+
+
+BUD_MARKERS = {
+    'grow': dict(marker='^', color='orange', s=12 ** 2),
+    'flower': dict(marker='*', color='red', s=4 ** 2),
+    'dormant': dict(marker='o', color='gray', s=3 ** 2),
+    'abort': dict(marker='x', color='black', s=2 ** 2),
+}
+
+
+def save_skeleton_png(filename, trunks, buds, branch_trees, leaves, dpi=300):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.collections import LineCollection
+
+    fig = Figure(figsize=(8, 8))
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+
+    ax.add_collection(LineCollection([np.column_stack([x, y]) for x, y in trunks], colors='sienna', linewidths=1.5))
+    ax.add_collection(LineCollection(as_forest(branch_trees).segments(), colors='peru', linewidths=1))
+
+    x0, y0 = trunks[0][0][0], trunks[0][1][0]
+    ax.plot(x0, y0, marker='s', color='blue', markersize=6, label='Start Point')
+
+    for fate, style in BUD_MARKERS.items():
+        pos = [bud['pos'] for bud in buds if bud['fate'] == fate]
+        if pos:
+            ax.scatter(*np.asarray(pos, dtype=float).T, zorder=3, **style)
+
+    if leaves:
+        ax.scatter(*np.asarray(leaves, dtype=float).T, marker='.', color='green', s=3 ** 2, zorder=3)
+
+    ax.axis('equal')
+    ax.axis('off')
+    ax.legend()
+    fig.tight_layout()
+    fig.savefig(filename, dpi=dpi, bbox_inches='tight')
+    print(f"Tree skeleton saved to {filename}")
 
-    def draw_branch_skeleton(branch_node):
-        pts = branch_node["points"]
-        for i in range(1, len(pts)):
-            x0, y0 = pts[i-1]
-            x1, y1 = pts[i]
-            plt.plot([x0, x1], [y0, y1], color='peru', linewidth=1)
 
-        for child in branch_node.get("children", []):
-            draw_branch_skeleton(child)
+def save_skeleton_json(filename, trunks, buds, branch_trees, leaves):
+    export_tree_to_json(filename, trunks, buds, branch_trees, leaves)
 
-    for tree in all_branch_trees:
-        draw_branch_skeleton(tree)
 
+# optional debug output stages; a stage is called as stage(basename, trunks, buds, branch_trees, leaves)
+SKELETON_OUTPUTS = {
+    "png": lambda basename, *skeleton: save_skeleton_png(f"{basename}.png", *skeleton),
+    "json": lambda basename, *skeleton: save_skeleton_json(f"{basename}.json", *skeleton),
+}
 
-    for bud in all_buds:
-        x, y = bud['pos']
-        fate = bud['fate']
-        if fate == 'grow':
-            plt.plot(x, y, marker='^', color='orange', markersize=12)
-        elif fate == 'flower':
-            plt.plot(x, y, marker='*', color='red', markersize=4)
-        elif fate == 'dormant':
-            plt.plot(x, y, marker='o', color='gray', markersize=3)
-        elif fate == 'abort':
-            plt.plot(x, y, marker='x', color='black', markersize=2)
-
-    for bx, by in all_leaves:
-        plt.plot(bx, by, marker='.', color='green', markersize=3)
-
-    plt.axis('equal')
-    plt.axis('off')
-    plt.legend()
-    plt.tight_layout()
-    plt.savefig(f"pics/ske_{str(filename)}.png", dpi=300, bbox_inches='tight')
-    plt.close()
-    print(f"Tree skeleton saved to {filename}")
-    export_tree_to_json(f"pics/ske_{str(filename)}.json", all_trunk_segments[::-1], all_buds[::-1], all_branch_trees[::-1], all_leaves[::-1])
-    return all_trunk_segments[::-1], all_buds[::-1], all_branch_trees[::-1], all_leaves[::-1]
+
+def write_skeleton_outputs(basename, skeleton, outputs):
+    for output in outputs:
+        write = output if callable(output) else SKELETON_OUTPUTS[output]
+        with metrics.stage(f"export_{output if isinstance(output, str) else output.__name__}"):
+            write(basename, *skeleton)
+
+
+def draw_random_trunk_curve(filename, n=6, max_depth=3, base_step=14, angle_range=(-30, 30), length_range=(20, 40), node_budget=None, segment_budget=None, outputs=("png", "json")):
+    skeleton = generate_tree(n=n, max_depth=max_depth, base_step=base_step, angle_range=angle_range, length_range=length_range,
+                             node_budget=node_budget, segment_budget=segment_budget)
+
+    write_skeleton_outputs(f"pics/ske_{str(filename)}", skeleton, outputs)
+    return skeleton
 
 if __name__ == "__main__":
-    draw_random_trunk_curve()
\ No newline at end of file
+    draw_random_trunk_curve(0)
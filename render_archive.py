@@ -0,0 +1,116 @@
+import argparse
+import glob
+import json
+import os
+import random
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from cache import cache_key
+from colors import trunk_colors, leaves_colors, plant_pot_colors
+from main import assign_path_widths, draw_tree_with_widths, seed_tree, tree_seed, RENDER_BACKENDS, RENDER_SUFFIXES
+from util import import_tree_from_json, SkeletonPack
+
+MANIFEST = "render_manifest.json"
+
+
+def find_skeletons(inputs):
+    # (path, index inside a pack or None, output stem)
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "ske_*.json")
+        for path in sorted(glob.glob(pattern)):
+            stem = os.path.splitext(os.path.basename(path))[0]
+            if path.endswith(".json"):
+                yield path, None, stem[len("ske_"):] if stem.startswith("ske_") else stem
+            else:
+                for i in range(len(SkeletonPack(path))):
+                    yield path, i, f"{stem}_{i}"
+
+
+def load_skeleton(path, index):
+    if index is None:
+        return import_tree_from_json(path)
+    return SkeletonPack(path)[index]
+
+
+def pick_palette(seed, palette):
+    rng = random.Random(seed)
+    choices = []
+    for options, fixed in zip((trunk_colors, leaves_colors, plant_pot_colors), palette):
+        choices.append(options[fixed] if fixed is not None else rng.choice(options))
+    return choices
+
+
+def render_job(job):
+    path, index, filename, seed, palette, trunk_main_width, trunk_min_width, dpi, backend, lod = job
+    trunks, buds, branches, leaves = load_skeleton(path, index)
+    seed_tree(seed)
+    trunk_width, branch_width = assign_path_widths(trunks, branches, trunk_main_width=trunk_main_width, trunk_min_width=trunk_min_width)
+    trunk_color, leaf_color, pot_color = palette
+    draw_tree_with_widths(trunks, trunk_width, branches, branch_width, buds=buds, leaves=leaves, filename=filename, trunk_color=trunk_color, leaf_color=leaf_color, pot_color=pot_color, dpi=dpi, backend=backend, lod=lod)
+    return filename
+
+
+def render_archive(inputs, out_dir="pics", workers=1, base_seed=0, palette=(None, None, None), trunk_main_width=60, trunk_min_width=1, dpi=300, backend="matplotlib", lod=False, force=False):
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    jobs, keys, total = [], {}, 0
+    for path, index, stem in find_skeletons(inputs):
+        filename = os.path.join(out_dir, f"{stem}{RENDER_SUFFIXES[backend]}")
+        total += 1
+        seed = tree_seed(base_seed, zlib.crc32(stem.encode("utf-8")))
+        chosen = pick_palette(seed, palette)
+        key = cache_key(os.path.abspath(path), index, seed, chosen, trunk_main_width, trunk_min_width, dpi, backend, lod)
+
+        # only missing images, images older than their skeleton, or ones rendered with other options
+        stale = force or not os.path.exists(filename) \
+            or os.path.getmtime(filename) < os.path.getmtime(path) \
+            or manifest.get(os.path.basename(filename)) != key
+        if stale:
+            jobs.append((path, index, filename, seed, chosen, trunk_main_width, trunk_min_width, dpi, backend, lod))
+            keys[filename] = key
+
+    print(f"{len(jobs)} of {total} images need rendering")
+    try:
+        if workers <= 1:
+            for job in jobs:
+                manifest[os.path.basename(render_job(job))] = keys[job[2]]
+        else:
+            chunksize = max(1, len(jobs) // (workers * 4))
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for filename in pool.map(render_job, jobs, chunksize=chunksize):
+                    manifest[os.path.basename(filename)] = keys[filename]
+    finally:
+        tmp = manifest_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp, manifest_path)
+    return [job[2] for job in jobs]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-render saved skeletons without regenerating them.")
+    parser.add_argument("inputs", nargs="+", help="directories, JSON globs or binary skeleton packs")
+    parser.add_argument("-o", "--out-dir", default="pics")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0, help="base seed for palette choice and leaf noise")
+    parser.add_argument("--trunk-palette", type=int, default=None, help="index into colors.trunk_colors")
+    parser.add_argument("--leaf-palette", type=int, default=None, help="index into colors.leaves_colors")
+    parser.add_argument("--pot-palette", type=int, default=None, help="index into colors.plant_pot_colors")
+    parser.add_argument("--trunk-main-width", type=float, default=60)
+    parser.add_argument("--trunk-min-width", type=float, default=1)
+    parser.add_argument("--dpi", type=float, default=300)
+    parser.add_argument("--backend", default="matplotlib", choices=sorted(RENDER_BACKENDS))
+    parser.add_argument("--lod", action="store_true", help="drop trunk points and leaves too small to see at this dpi")
+    parser.add_argument("--force", action="store_true", help="re-render even up-to-date images")
+    args = parser.parse_args()
+
+    render_archive(args.inputs, out_dir=args.out_dir, workers=args.workers, base_seed=args.seed,
+                   palette=(args.trunk_palette, args.leaf_palette, args.pot_palette),
+                   trunk_main_width=args.trunk_main_width, trunk_min_width=args.trunk_min_width,
+                   dpi=args.dpi, backend=args.backend, lod=args.lod, force=args.force)
@@ -0,0 +1,275 @@
+import random
+import numpy as np
+from forest import as_forest
+from pot import plant_pot_bounds
+from trunks import TrunkIndex
+
+
+LOD_TOLERANCE = 0.25
+LOD_MIN_LEAF_PIXELS = 4
+
+
+def sample_canopy_leaves(centers, width, height, leaf_color, leaf_count=200, size_scale=1.0):
+    centers = np.asarray(centers, dtype=float).reshape(-1, 2)
+    n = len(centers) * leaf_count
+    cx, cy = np.repeat(centers, leaf_count, axis=0).T
+
+    # uniform inside each ellipse, same distribution as rejection sampling
+    r = np.sqrt(np.random.uniform(0, 1, n))
+    theta = np.random.uniform(0, 2 * np.pi, n)
+    xs = cx + r * np.cos(theta) * (width / 2)
+    ys = cy + r * np.sin(theta) * (height / 2)
+
+    leaf_widths = np.random.uniform(1.5, 3, n) * size_scale
+    leaf_heights = np.random.uniform(4, 7, n) * size_scale
+    angles = np.random.normal(loc=180, scale=10, size=n)
+    colors = np.asarray(leaf_color)[np.random.randint(len(leaf_color), size=n)]
+
+    return np.column_stack([xs, ys]), leaf_widths, leaf_heights, angles, colors
+
+
+def collect_leaf_positions(buds, branch_trees):
+    return as_forest(branch_trees).tips()
+
+
+def assign_path_widths(trunks, branch_trees, trunk_main_width=50, trunk_min_width=1):
+    trunk_widths = []
+    for i, (xs, ys) in enumerate(trunks):
+        L = len(xs)
+        start_w = trunk_main_width if i == 0 else trunk_main_width / 2
+        end_w = trunk_min_width if i == 0 else trunk_min_width / 2
+        widths = np.linspace(start_w, end_w, L)
+        trunk_widths.append(widths)
+
+    # branches start at trunk samples; take the width of the nearest one
+    starts = as_forest(branch_trees).root_starts()
+    if len(starts) and trunks:
+        nearest = TrunkIndex(trunks, trunk_widths).query(starts)["width"]
+        branch_start_widths = np.minimum(10, nearest // 2).tolist()
+    else:
+        branch_start_widths = [5] * len(starts)
+
+    return trunk_widths, branch_start_widths
+
+
+def flatten_branch_segments(branches, branch_widths, decay=0.7):
+    forest = as_forest(branches)
+    return forest.segments(), forest.segment_widths(branch_widths, decay=decay)
+
+
+def points_bounds(*point_sets):
+    pts = [np.asarray(p, dtype=float).reshape(-1, 2) for p in point_sets if len(p)]
+    if not pts:
+        return None
+    pts = np.concatenate(pts)
+    return (*pts.min(axis=0), *pts.max(axis=0))
+
+
+def union_bounds(*bounds):
+    bounds = [b for b in bounds if b is not None]
+    xmin, ymin, xmax, ymax = np.array(bounds).T
+    return xmin.min(), ymin.min(), xmax.max(), ymax.max()
+
+
+def scene_bounds(trunks, branches, leaf_positions, root, canopy=(60, 25), leaf_size=7):
+    forest = as_forest(branches)
+    tips = np.asarray(leaf_positions, dtype=float).reshape(-1, 2)
+    reach = np.array([canopy[0] / 2, canopy[1] / 2]) + leaf_size / 2
+    return union_bounds(
+        points_bounds(*[np.column_stack([xs, ys]) for xs, ys in trunks], forest.points),
+        points_bounds(tips - reach, tips + reach),
+        plant_pot_bounds(root[0], root[1] - 17),
+    )
+
+
+def view_limits(bounds, pad_points=0, size=10, margin=0.1):
+    # square (xmin, xmax, ymin, ymax) showing bounds on a size x size inch
+    # image with margin inches spare. pad_points covers line widths, which are
+    # in points and so only map to data units once the scale is known.
+    xmin, ymin, xmax, ymax = bounds
+    cx, cy = (xmin + xmax) / 2, (ymin + ymax) / 2
+    extent = max(xmax - xmin, ymax - ymin, 1e-6) / 2
+    inner = (size - 2 * margin) * 72
+    # solve half = extent + pad_points / (inner / (2 * half)) for half
+    half = extent / (1 - 2 * pad_points / inner)
+    half *= size * 72 / inner
+    return cx - half, cx + half, cy - half, cy + half
+
+
+def simplify_polyline(points, widths, tolerance, width_tolerance):
+    # keep just enough of the dense samples: a span is split at its middle
+    # sample while any sample inside strays further than tolerance from the
+    # chord, or its width (drawn as the start width) drifts past
+    # width_tolerance, so curved and tapering stretches keep more points
+    n = len(points)
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, -1]] = True
+    spans = [(0, n - 1)]
+    while spans:
+        i, j = spans.pop()
+        if j - i < 2:
+            continue
+        chord = points[j] - points[i]
+        offset = points[i + 1:j] - points[i]
+        length = np.hypot(*chord)
+        if length > 0:
+            dist = np.abs(chord[0] * offset[:, 1] - chord[1] * offset[:, 0]) / length
+        else:
+            dist = np.hypot(offset[:, 0], offset[:, 1])
+        drift = np.abs(widths[i:j] - widths[i])
+        if dist.max() <= tolerance and drift.max() <= width_tolerance:
+            continue
+        m = (i + j) // 2
+        keep[m] = True
+        spans += [(i, m), (m, j)]
+    return points[keep], widths[keep]
+
+
+def level_of_detail(bounds, pad_points, pixels, size=10, margin=0.1, leaf_count=50, tolerance=LOD_TOLERANCE, min_leaf_pixels=LOD_MIN_LEAF_PIXELS, leaf_height=5.5):
+    # trunk tolerances in data units and points, and the leaf count and size
+    # for an image pixels wide. Leaves shorter than min_leaf_pixels become
+    # fewer, larger ones with the same total area.
+    xmin, xmax, _, _ = view_limits(bounds, pad_points, size, margin)
+    px_scale = pixels / (xmax - xmin)
+    dpi = pixels / size
+    thin = min(1.0, (leaf_height * px_scale / min_leaf_pixels) ** 2)
+    count = max(1, int(round(leaf_count * thin)))
+    return {
+        "tolerance": tolerance / px_scale,
+        "width_tolerance": 2 * tolerance * 72 / dpi,
+        "leaf_count": count,
+        "leaf_scale": float(np.sqrt(leaf_count / count)),
+    }
+
+
+def build_scene(trunks, trunk_widths, branches, branch_widths, buds=None, trunk_color=["#43371f"], leaf_color=["#558172", "#96c49f"], pot_color=["4f4c5d"], decay=0.7, canopy=(60, 25), leaf_count=50, lod_pixels=None):
+    # every primitive of one render, in data units, independent of the backend.
+    # lod_pixels, the width of the target image, trims detail it cannot show
+    root = (trunks[0][0][0], trunks[0][1][0])
+    selected_pot_color = random.choice(pot_color)
+    selected_trunk_color = random.choice(trunk_color)
+
+    branch_segments, branch_segment_widths = flatten_branch_segments(branches, branch_widths, decay=decay)
+    leaf_pos = collect_leaf_positions(buds, branches)
+    max_width = max([float(np.max(ws)) for ws in trunk_widths if len(ws)] + [0])
+    bounds = scene_bounds(trunks, branches, leaf_pos, root, canopy=canopy)
+    trunk_paths = [(np.column_stack([xs, ys]), np.asarray(ws, dtype=float)) for (xs, ys), ws in zip(trunks, trunk_widths)]
+
+    leaf_scale = 1.0
+    if lod_pixels is not None:
+        lod = level_of_detail(bounds, max_width / 2, lod_pixels, leaf_count=leaf_count)
+        trunk_paths = [simplify_polyline(points, widths, lod["tolerance"], lod["width_tolerance"]) for points, widths in trunk_paths]
+        leaf_count, leaf_scale = lod["leaf_count"], lod["leaf_scale"]
+    leaves = sample_canopy_leaves(leaf_pos, canopy[0], canopy[1], leaf_color, leaf_count, size_scale=leaf_scale)
+
+    return {
+        "pot_origin": (root[0], root[1] - 17),
+        "pot_color": selected_pot_color,
+        "trunk_color": selected_trunk_color,
+        "trunks": trunk_paths,
+        "branch_segments": branch_segments,
+        "branch_widths": branch_segment_widths,
+        "leaf_positions": leaf_pos,
+        "leaves": leaves,
+        "bounds": bounds,
+        "pad_points": max_width / 2,
+    }
+
+
+def occlusion_depth(alpha, levels=255):
+    # layers of alpha over a pixel after which anything underneath moves the
+    # final value by less than half a step
+    return int(np.ceil(np.log(0.5 / levels) / np.log(1 - alpha)))
+
+
+def _rect_cells(x0, x1, y0, y1):
+    # every (leaf, x, y) inside the per-leaf half open cell ranges, flattened
+    nx, ny = np.maximum(x1 - x0, 0), np.maximum(y1 - y0, 0)
+    counts = nx * ny
+    leaf = np.repeat(np.arange(len(counts)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return leaf, x0[leaf] + local % nx[leaf], y0[leaf] + local // nx[leaf], counts
+
+
+def cull_hidden_leaves(scene, dpi, size=10, margin=0.1, alpha=0.8, outline_points=1, cell_pixels=None):
+    # drop leaves that cannot change a pixel because they are buried
+    # occlusion_depth layers deep in every screen space cell they touch,
+    # where a layer is a later leaf covering the whole cell. Per cell
+    # only the depth-th topmost full cover matters, so the walk down the
+    # stack reduces to a sort and a min per leaf.
+    offsets, widths, heights, angles, colors = scene["leaves"]
+    if len(offsets) == 0:
+        return scene
+    xmin, xmax, ymin, ymax = view_limits(scene["bounds"], scene["pad_points"], size, margin)
+    pixels = int(round(size * dpi))
+    px_scale = pixels / (xmax - xmin)
+    if cell_pixels is None:
+        # a few cells across a typical leaf
+        cell_pixels = max(1.0, float(np.median(widths)) * px_scale / 3)
+    cells = int(np.ceil(pixels / cell_pixels))
+    scale = px_scale / cell_pixels
+    depth = occlusion_depth(alpha)
+
+    cx = (offsets[:, 0] - xmin) * scale
+    cy = (ymax - offsets[:, 1]) * scale
+    a, b = np.asarray(widths) / 2 * scale, np.asarray(heights) / 2 * scale
+    rad = np.radians(angles)
+    cos, sin = np.cos(rad), np.sin(rad)
+    hx, hy = np.hypot(a * cos, b * sin), np.hypot(a * sin, b * cos)
+
+    # only where leaves pile up depth layers deep on average can anything be
+    # buried. The rest are kept and left out as covers, which can only make
+    # the test below keep more, so sparse canopies cost next to nothing.
+    bin_size = 2 * float(max(hx.max(), hy.max()))
+    bins = int(np.ceil(cells / bin_size))
+    leaf_bin = np.clip((cy // bin_size).astype(int), 0, bins - 1) * bins + np.clip((cx // bin_size).astype(int), 0, bins - 1)
+    layers = np.bincount(leaf_bin, weights=np.pi * a * b, minlength=bins * bins) / bin_size ** 2
+    dense = np.flatnonzero(layers[leaf_bin] >= depth)
+    if len(dense) == 0:
+        return scene
+    cx, cy, a, b, cos, sin, hx, hy = (v[dense] for v in (cx, cy, a, b, cos, sin, hx, hy))
+
+    def cell_range(centre, half):
+        lo = np.clip(np.floor(centre - half), 0, cells).astype(int)
+        hi = np.clip(np.ceil(centre + half), 0, cells).astype(int)
+        return lo, hi
+
+    # cells each bare ellipse covers completely: all four corners inside,
+    # with the rotated ellipse as qa dx^2 + qb dx dy + qc dy^2 <= 1
+    qa = (cos / a) ** 2 + (sin / b) ** 2
+    qb = 2 * cos * sin * (1 / a ** 2 - 1 / b ** 2)
+    qc = (sin / a) ** 2 + (cos / b) ** 2
+    (x0, x1), (y0, y1) = cell_range(cx, hx), cell_range(cy, hy)
+    corner_leaf, x, y, corner_counts = _rect_cells(x0, x1 + 1, y0, y1 + 1)
+    dx, dy = x - cx[corner_leaf], cy[corner_leaf] - y
+    inside = qa[corner_leaf] * dx * dx + qb[corner_leaf] * dx * dy + qc[corner_leaf] * dy * dy <= 1
+    leaf, x, y, _ = _rect_cells(x0, x1, y0, y1)
+    row = (x1 - x0 + 1)[leaf]
+    corner = (np.cumsum(corner_counts) - corner_counts)[leaf] + (y - y0[leaf]) * row + (x - x0[leaf])
+    full = inside[corner] & inside[corner + 1] & inside[corner + row] & inside[corner + row + 1]
+    leaf, cell = leaf[full], (y * cells + x)[full]
+
+    # per cell, the depth-th topmost leaf covering it; anything below is
+    # buried. Cells come out in leaf order, so a stable sort keeps the
+    # topmost leaf last in each run.
+    order = np.argsort(cell, kind="stable")
+    leaf, cell = leaf[order], cell[order]
+    cell_ids, first, count = np.unique(cell, return_index=True, return_counts=True)
+    buried_below = np.full(cells * cells, -1)
+    deep = count >= depth
+    buried_below[cell_ids[deep]] = leaf[first[deep] + count[deep] - depth]
+
+    # the drawn leaf also has an edge stroke and a pixel of anti-aliasing
+    reach = (outline_points * dpi / 72 / 2 + 1) / cell_pixels
+    leaf, x, y, counts = _rect_cells(*cell_range(cx, hx + reach), *cell_range(cy, hy + reach))
+    # leaves clipped off the grid touch no cell and are dropped; the rest
+    # reduce over their own cells, which reduceat needs non-empty
+    visible = counts > 0
+    if leaf.size:
+        starts = (np.cumsum(counts) - counts)[visible]
+        lowest = np.minimum.reduceat(buried_below[y * cells + x], starts)
+        visible[visible] = np.flatnonzero(visible) >= lowest
+    keep = np.ones(len(offsets), dtype=bool)
+    keep[dense] = visible
+
+    return dict(scene, leaves=tuple(np.asarray(part)[keep] for part in scene["leaves"]))
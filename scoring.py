@@ -0,0 +1,157 @@
+import numpy as np
+import metrics
+from forest import as_forest
+from pot import plant_pot_top
+
+# where build_scene puts the pot under the trunk root
+POT_DROP = 17
+
+SCORES = ("lean", "width", "height", "aspect", "tips", "crossings", "pot_clearance", "grow_buds")
+
+# a limit named min_<score> or max_<score> bounds that score from below or
+# above. Measured on 300 trees each of the default profile at base seeds 0,
+# 1, 42 and 1234: the shape limits each reject 1-6% of trees, about 4% over
+# all 1200. Branches dipping below the soil or rim reject 10-13%, since any
+# dip counts. Together they fail 20-27% of first candidates, so --reject
+# regrows about one tree in four.
+SCORE_LIMITS = {
+    "max_lean": 0.55,
+    "max_aspect": 1.5,
+    "min_tips": 15,
+    "max_crossings": 0.08,
+    "min_pot_clearance": 0.0,
+}
+
+
+def skeleton_segments(trunks, branches):
+    # every trunk and branch segment as one (n, 2, 2) array
+    parts = [np.stack([np.column_stack([xs[:-1], ys[:-1]]), np.column_stack([xs[1:], ys[1:]])], axis=1)
+             for xs, ys in trunks if len(xs) > 1]
+    parts.append(as_forest(branches).segments().reshape(-1, 2, 2))
+    return np.concatenate(parts).astype(float)
+
+
+def _orientation(o, u, v):
+    return np.sign((u[:, 0] - o[:, 0]) * (v[:, 1] - o[:, 1]) - (u[:, 1] - o[:, 1]) * (v[:, 0] - o[:, 0]))
+
+
+def segment_crossings(segments, cell=None):
+    # proper crossings only: segments meeting at an end, like a branch leaving
+    # its trunk, do not count. Segments are bucketed into grid cells by their
+    # boxes and only pairs sharing a cell are tested.
+    segments = np.asarray(segments, dtype=float).reshape(-1, 2, 2)
+    if len(segments) < 2:
+        return 0
+    lo, hi = segments.min(axis=1), segments.max(axis=1)
+    if cell is None:
+        cell = max(2 * float(np.median(np.hypot(*(segments[:, 1] - segments[:, 0]).T))), 1e-6)
+    c0 = np.floor(lo / cell).astype(np.int64)
+    spans = np.floor(hi / cell).astype(np.int64) - c0 + 1
+    counts = spans[:, 0] * spans[:, 1]
+
+    seg = np.repeat(np.arange(len(segments)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    cx = c0[seg, 0] + local % spans[seg, 0]
+    cy = c0[seg, 1] + local // spans[seg, 0]
+    key = (cx - cx.min()) * (cy.max() - cy.min() + 1) + (cy - cy.min())
+    order = np.argsort(key, kind="stable")
+    key, seg = key[order], seg[order]
+
+    # every pair within a run of equal keys
+    starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+    run_end = np.repeat(np.r_[starts[1:], len(key)], np.diff(np.r_[starts, len(key)]))
+    after = run_end - np.arange(len(key)) - 1
+    first = np.repeat(np.arange(len(key)), after)
+    second = first + 1 + np.arange(after.sum()) - np.repeat(np.cumsum(after) - after, after)
+    pairs = np.unique(np.sort(np.column_stack([seg[first], seg[second]]), axis=1), axis=0)
+    a, b = pairs[pairs[:, 0] != pairs[:, 1]].T
+
+    p, p2, q, q2 = segments[a, 0], segments[a, 1], segments[b, 0], segments[b, 1]
+    crosses = (_orientation(p, p2, q) * _orientation(p, p2, q2) < 0) & (_orientation(q, q2, p) * _orientation(q, q2, p2) < 0)
+    return int(crosses.sum())
+
+
+def pot_clearance(segments, edge_x, edge_y):
+    # lowest height of any segment over the pot's top edge. The edge is linear
+    # between its corners, so a segment comes lowest at an end or where it
+    # passes over a corner; inf if nothing is over the pot.
+    p, q = segments[:, 0], segments[:, 1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = (edge_x[None, :] - p[:, :1]) / (q[:, :1] - p[:, :1])
+    rows, cols = np.nonzero(np.isfinite(t) & (t >= 0) & (t <= 1))
+    corners = p[rows] + t[rows, cols][:, None] * (q[rows] - p[rows])
+    points = np.concatenate([segments.reshape(-1, 2), corners])
+    points = points[(points[:, 0] >= edge_x[0]) & (points[:, 0] <= edge_x[-1])]
+    if len(points) == 0:
+        return float("inf")
+    return float((points[:, 1] - np.interp(points[:, 0], edge_x, edge_y)).min())
+
+
+def score_skeleton(skeleton):
+    # cheap shape measures from the skeleton alone, in data units:
+    #   lean          length weighted centre of the tree left or right of the root, over height
+    #   width, height and aspect of the box around trunks and branches
+    #   tips          branch tips, where the canopy grows
+    #   crossings     segment crossings per segment
+    #   pot_clearance lowest point over the pot above its soil or rim; negative dips into it
+    #   grow_buds     buds that grew branches, for context when tips are few
+    trunks, buds, branches, leaves = skeleton
+    root_x, root_y = float(trunks[0][0][0]), float(trunks[0][1][0])
+    segments = skeleton_segments(trunks, branches)
+    points = segments.reshape(-1, 2)
+    lengths = np.hypot(*(segments[:, 1] - segments[:, 0]).T)
+    mid_x = segments[:, :, 0].mean(axis=1)
+
+    xmin, ymin = points.min(axis=0)
+    xmax, ymax = points.max(axis=0)
+    height = max(float(ymax) - root_y, 1e-6)
+    width = float(xmax - xmin)
+    centre = float(np.average(mid_x, weights=lengths)) if lengths.sum() > 0 else root_x
+
+    return {
+        "lean": abs(centre - root_x) / height,
+        "width": width,
+        "height": height,
+        "aspect": width / height,
+        "tips": int(len(as_forest(branches).tips())),
+        "crossings": segment_crossings(segments) / len(segments),
+        "pot_clearance": pot_clearance(segments, *plant_pot_top(root_x, root_y - POT_DROP)),
+        "grow_buds": sum(bud["fate"] == "grow" for bud in buds),
+    }
+
+
+def failed_limits(scores, limits):
+    # names of the limits these scores break
+    failed = []
+    for name, limit in limits.items():
+        bound, _, score = name.partition("_")
+        value = scores[score]
+        if (bound == "min" and value < limit) or (bound == "max" and value > limit):
+            failed.append(name)
+    return failed
+
+
+def parse_limits(pairs, limits=SCORE_LIMITS):
+    # NAME=VALUE overrides on top of limits
+    limits = dict(limits)
+    for pair in pairs:
+        name, _, value = pair.partition("=")
+        bound, _, score = name.partition("_")
+        if bound not in ("min", "max") or score not in SCORES or not value:
+            raise ValueError(f"expected min_<score>=VALUE or max_<score>=VALUE with a score from {', '.join(SCORES)}, got {pair}")
+        limits[name] = float(value)
+    return limits
+
+
+def first_passing(skeletons, limits):
+    # score trees from an iterable, usually regrown lazily, until one passes.
+    # Returns it, or None if none did, with the scores of every candidate.
+    candidates = []
+    for skeleton in skeletons:
+        with metrics.stage("score"):
+            scores = score_skeleton(skeleton)
+        failed = failed_limits(scores, limits)
+        candidates.append(dict(scores, failed=failed))
+        if not failed:
+            return skeleton, candidates
+    return None, candidates
@@ -0,0 +1,238 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+from main import GEN_PARAMS, RENDER_SUFFIXES, render_skeleton, tree_palette, tree_seed
+from recur import TreeGenerator
+from util import skeleton_data
+
+# what a request may ask for; the caps keep any one tree from holding a
+# worker long enough to stall everyone queued behind it
+GEN_LIMITS = {"n": (2, 12), "max_depth": (1, 10), "node_budget": (1, 20000)}
+DPI_LIMITS = (10, 600)
+FORMATS = {
+    "/tree.json": ("json", None, "application/json"),
+    "/tree.png": ("image", ("matplotlib", "raster"), "image/png"),
+    "/tree.svg": ("image", ("svg",), "image/svg+xml"),
+}
+STATUS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+          500: "Internal Server Error", 503: "Service Unavailable", 504: "Gateway Timeout"}
+
+
+class BadRequest(ValueError):
+    pass
+
+
+class Busy(Exception):
+    pass
+
+
+def skeleton_json(seed, gen_params):
+    # a generator per call touches no shared state, so this runs on any thread
+    skeleton = TreeGenerator(**gen_params).generate(seed)
+    return json.dumps(skeleton_data(*skeleton)).encode("utf-8")
+
+
+def render_tree(seed, gen_params, dpi, backend, lod):
+    # runs in a worker process: the backends share a canvas and draw leaf
+    # noise from the global generators, which is fine one tree at a time
+    skeleton = TreeGenerator(**gen_params).generate(seed)
+    render_seed = tree_seed(seed, 1)
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+        filename = render_skeleton(skeleton, render_seed, tree_palette(render_seed), os.path.join(tmp, f"tree{RENDER_SUFFIXES[backend]}"),
+                                   dpi=dpi, backend=backend, lod=lod)
+        with open(filename, "rb") as f:
+            return f.read()
+
+
+def _number(query, name, kind, default, limits=None):
+    values = query.get(name)
+    if not values:
+        return default
+    try:
+        value = kind(values[-1])
+    except ValueError:
+        raise BadRequest(f"{name} must be a {kind.__name__}")
+    if limits is not None and not limits[0] <= value <= limits[1]:
+        raise BadRequest(f"{name} must be between {limits[0]} and {limits[1]}")
+    return value
+
+
+def parse_tree_request(path, query):
+    # the cache key and the work for one request; equivalent queries map to the
+    # same key, so they share a cache entry and an in-flight job
+    if path not in FORMATS:
+        raise LookupError(path)
+    kind, backends, content_type = FORMATS[path]
+    # seed is one tree's own seed; base_seed and index name tree index of a
+    # main.py or pipeline.py run with --seed base_seed, and resolve to the same key
+    if ("seed" in query) == ("base_seed" in query or "index" in query):
+        raise BadRequest("give either seed, or base_seed and index")
+    if "seed" in query:
+        seed = _number(query, "seed", int, None, (0, 2**32 - 1))
+    elif "base_seed" in query and "index" in query:
+        seed = tree_seed(_number(query, "base_seed", int, None, (0, 2**32 - 1)), _number(query, "index", int, None, (0, 2**32 - 1)))
+    else:
+        raise BadRequest("base_seed needs index and index needs base_seed")
+    gen_params = dict(GEN_PARAMS)
+    for name, limits in GEN_LIMITS.items():
+        gen_params[name] = _number(query, name, int, gen_params[name], limits)
+    gen_key = tuple(sorted(gen_params.items()))
+    if kind == "json":
+        return ("json", seed, gen_key), skeleton_json, (seed, gen_params), content_type
+
+    backend = query.get("backend", [backends[0]])[-1]
+    if backend not in backends:
+        raise BadRequest(f"backend must be one of {', '.join(backends)}")
+    dpi = _number(query, "dpi", float, 100.0, DPI_LIMITS)
+    lod = query.get("lod", ["0"])[-1] not in ("0", "false", "")
+    return ("image", seed, gen_key, dpi, backend, lod), render_tree, (seed, gen_params, dpi, backend, lod), content_type
+
+
+class TreeService:
+    # renders in worker processes and skeletons on threads. Identical requests
+    # in flight share one job, finished results stay in an LRU bounded in
+    # bytes, and once max_pending jobs are queued new work is turned away
+    # instead of making every response slower.
+    def __init__(self, workers=2, threads=4, cache_bytes=64 << 20, max_pending=64, timeout=30.0):
+        # forkserver workers inherit neither the listening socket nor the
+        # threads, which a forked worker would carry off with it
+        self.processes = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("forkserver"))
+        self.threads = ThreadPoolExecutor(max_workers=threads)
+        self.cache = OrderedDict()
+        self.cache_bytes = cache_bytes
+        self.cached_bytes = 0
+        self.inflight = {}
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.stats = {"requests": 0, "hits": 0, "coalesced": 0, "computed": 0, "rejected": 0, "errors": 0}
+
+    def remember(self, key, data):
+        if len(data) > self.cache_bytes:
+            return
+        if key in self.cache:
+            self.cached_bytes -= len(self.cache.pop(key))
+        self.cache[key] = data
+        self.cached_bytes += len(data)
+        while self.cached_bytes > self.cache_bytes:
+            _, old = self.cache.popitem(last=False)
+            self.cached_bytes -= len(old)
+
+    async def result(self, key, fn, args):
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.stats["hits"] += 1
+            return self.cache[key]
+        future = self.inflight.get(key)
+        if future is not None:
+            self.stats["coalesced"] += 1
+        else:
+            if len(self.inflight) >= self.max_pending:
+                self.stats["rejected"] += 1
+                raise Busy()
+            executor = self.threads if fn is skeleton_json else self.processes
+            future = asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+            self.inflight[key] = future
+            self.stats["computed"] += 1
+
+            def done(f, key=key):
+                del self.inflight[key]
+                if not f.cancelled() and f.exception() is None:
+                    self.remember(key, f.result())
+            future.add_done_callback(done)
+        # shielded, so a client that gives up does not cancel work others wait on
+        return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+
+    async def respond(self, method, target):
+        if method not in ("GET", "HEAD"):
+            return 405, "text/plain", b"only GET\n"
+        url = urlsplit(target)
+        if url.path == "/stats":
+            stats = dict(self.stats, inflight=len(self.inflight), cached=len(self.cache), cached_bytes=self.cached_bytes)
+            return 200, "application/json", json.dumps(stats).encode("utf-8")
+        try:
+            key, fn, args, content_type = parse_tree_request(url.path, parse_qs(url.query))
+            return 200, content_type, await self.result(key, fn, args)
+        except LookupError:
+            return 404, "text/plain", b"not found\n"
+        except BadRequest as e:
+            return 400, "text/plain", f"{e}\n".encode("utf-8")
+        except Busy:
+            return 503, "text/plain", b"busy, retry shortly\n"
+        except asyncio.TimeoutError:
+            return 504, "text/plain", b"timed out, retry shortly\n"
+        except Exception as e:
+            self.stats["errors"] += 1
+            return 500, "text/plain", f"{type(e).__name__}: {e}\n".encode("utf-8")
+
+    async def handle(self, reader, writer):
+        # HTTP/1.1 with keep-alive; requests on one connection are answered in order
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.timeout)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+                    return
+                lines = head.decode("latin-1").split("\r\n")
+                parts = lines[0].split()
+                if len(parts) != 3:
+                    return
+                method, target, version = parts
+                headers = {k.strip().lower(): v.strip() for k, _, v in (line.partition(":") for line in lines[1:] if line)}
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+
+                self.stats["requests"] += 1
+                status, content_type, body = await self.respond(method, target)
+                response = [f"HTTP/1.1 {status} {STATUS[status]}", f"Content-Type: {content_type}",
+                            f"Content-Length: {len(body)}", f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+                if status in (503, 504):
+                    response.append("Retry-After: 1")
+                writer.write(("\r\n".join(response) + "\r\n\r\n").encode("latin-1"))
+                if method != "HEAD":
+                    writer.write(body)
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        self.processes.shutdown(cancel_futures=True)
+        self.threads.shutdown(cancel_futures=True)
+
+
+async def serve(service, host="127.0.0.1", port=8000):
+    server = await asyncio.start_server(service.handle, host, port)
+    print(f"Serving trees on http://{host}:{port}/tree.png?seed=1")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve tree renders and skeletons over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1", help="interface to listen on, local only by default")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="render processes")
+    parser.add_argument("--threads", type=int, default=4, help="threads generating skeleton JSON")
+    parser.add_argument("--cache-mb", type=int, default=64, help="keep recent results up to this size")
+    parser.add_argument("--max-pending", type=int, default=64, help="distinct jobs queued before new ones get 503")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds a request waits for its job")
+    args = parser.parse_args()
+
+    service = TreeService(workers=args.workers, threads=args.threads, cache_bytes=args.cache_mb << 20,
+                          max_pending=args.max_pending, timeout=args.timeout)
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
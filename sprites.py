@@ -0,0 +1,98 @@
+from collections import OrderedDict
+import numpy as np
+from PIL import Image, ImageColor
+
+SIZE_STEP = 1.08
+ANGLE_STEP = 5
+COVERAGE_SAMPLES = 4
+
+_atlas = None
+
+
+class LeafAtlas:
+    # pre-rasterised leaf masks keyed by quantised pixel size and angle, with
+    # a solid tile per palette colour to blit through them. Keys live in pixel
+    # space, so trees drawn at different scales share sprites.
+    def __init__(self, size_step=SIZE_STEP, angle_step=ANGLE_STEP, samples=COVERAGE_SAMPLES, max_sprites=4096):
+        self.size_step = size_step
+        self.angle_step = angle_step
+        self.samples = samples
+        self.max_sprites = max_sprites
+        self.sprites = OrderedDict()
+
+    def keys(self, widths, heights, angles):
+        log_step = np.log(self.size_step)
+        w = np.round(np.log(np.maximum(widths, 1e-3)) / log_step).astype(int)
+        h = np.round(np.log(np.maximum(heights, 1e-3)) / log_step).astype(int)
+        # an ellipse looks the same turned by half a revolution
+        a = np.round(np.mod(angles, 180) / self.angle_step).astype(int) % int(round(180 / self.angle_step))
+        return np.column_stack([w, h, a])
+
+    def sprite(self, key, alpha, color):
+        key = (*key, alpha)
+        if key in self.sprites:
+            self.sprites.move_to_end(key)
+            half, mask, tiles = self.sprites[key]
+        else:
+            w_bin, h_bin, a_bin, _ = key
+            half, mask = render_leaf_mask(self.size_step ** w_bin, self.size_step ** h_bin, a_bin * self.angle_step, alpha, self.samples)
+            tiles = {}
+            self.sprites[key] = half, mask, tiles
+            if len(self.sprites) > self.max_sprites:
+                self.sprites.popitem(last=False)
+        if color not in tiles:
+            tiles[color] = Image.new("RGB", mask.size, color)
+        return half, mask, tiles[color]
+
+
+def render_leaf_mask(width, height, angle, alpha=1.0, samples=COVERAGE_SAMPLES):
+    # coverage of a rotated ellipse centred on the middle pixel, estimated on
+    # a samples x samples grid per pixel. Angles are counterclockwise with y up.
+    a, b = width / 2, height / 2
+    rad = np.radians(angle)
+    cos, sin = np.cos(rad), np.sin(rad)
+    half_x = int(np.ceil(np.hypot(a * cos, b * sin))) + 1
+    half_y = int(np.ceil(np.hypot(a * sin, b * cos))) + 1
+    offsets = (np.arange(samples) + 0.5) / samples - 0.5
+    xs = np.arange(-half_x, half_x + 1)[None, :, None, None] + offsets[None, None, None, :]
+    ys = -(np.arange(-half_y, half_y + 1)[:, None, None, None] + offsets[None, None, :, None])
+    u = xs * cos + ys * sin
+    v = -xs * sin + ys * cos
+    coverage = ((u / a) ** 2 + (v / b) ** 2 <= 1).mean(axis=(2, 3))
+    mask = Image.fromarray(np.round(coverage * alpha * 255).astype(np.uint8), "L")
+    return (half_x, half_y), mask
+
+
+def leaf_atlas():
+    global _atlas
+    if _atlas is None:
+        _atlas = LeafAtlas()
+    return _atlas
+
+
+def blit_leaves(image, centers, widths, heights, angles, colors, alpha=1.0, atlas=None):
+    # centers and sizes in pixels of image; each leaf is composited over what
+    # is already there with its sprite as the blend mask, in leaf order.
+    # Overlapping leaves must blend in order, and a vectorised numpy blend of
+    # that (gather, sort by pixel and leaf, blend by depth) measured ten times
+    # slower than Pillow's paste, so the blending stays in C. What the loop
+    # saves is Python: sprites are looked up once per distinct key and colour,
+    # and leaves go straight to the core paste, skipping the argument checks
+    # and loads Image.paste repeats on every call.
+    atlas = atlas or leaf_atlas()
+    if len(centers) == 0:
+        return
+    keys = atlas.keys(widths, heights, angles)
+    palette, color_ids = np.unique(colors, return_inverse=True)
+    fills = [ImageColor.getrgb(c)[:3] for c in palette]
+    unique, inverse = np.unique(np.column_stack([keys, color_ids.reshape(-1)]), axis=0, return_inverse=True)
+    sprites = []
+    for *key, color in unique.tolist():
+        (half_x, half_y), mask, tile = atlas.sprite(key, alpha, fills[color])
+        sprites.append((half_x, half_y, half_x - mask.width, half_y - mask.height, tile.im, mask.im))
+    image.load()
+    paste = image.im.paste
+    corners = np.floor(centers).astype(int).tolist()
+    for (x, y), sprite in zip(corners, inverse.reshape(-1).tolist()):
+        half_x, half_y, end_x, end_y, tile, mask = sprites[sprite]
+        paste(tile, (x - half_x, y - half_y, x - end_x, y - end_y), mask)
@@ -0,0 +1,129 @@
+import numpy as np
+from pot import rounded_trapezoid_verts, SOIL_LINEWIDTH
+from scene import view_limits
+
+LEAF_ALPHA = 0.8
+WIDTH_BAND_RATIO = 1.2
+LEAF_SHAPE_BANDS = 2
+
+
+def _fmt(value, precision):
+    text = f"{value:.{precision}f}".rstrip("0").rstrip(".")
+    return "0" if text in ("", "-0") else text
+
+
+def _coords(points, precision):
+    # x and flipped y, so data coordinates can be written straight into the
+    # y-down SVG user space
+    return [f"{_fmt(x, precision)} {_fmt(-y, precision)}" for x, y in np.asarray(points, dtype=float).tolist()]
+
+
+def width_bands(widths, ratio=WIDTH_BAND_RATIO):
+    # geometric bands, so every stroke lands within sqrt(ratio) of its width
+    widths = np.maximum(np.asarray(widths, dtype=float), 1e-3)
+    bands = np.round(np.log(widths) / np.log(ratio)).astype(int)
+    return bands, ratio ** bands.astype(float)
+
+
+def banded_paths(segments, widths, precision=2, ratio=WIDTH_BAND_RATIO):
+    # one path per width band; segments continuing the previous one in the
+    # same band extend its subpath instead of starting a new one
+    segments = np.asarray(segments, dtype=float).reshape(-1, 2, 2)
+    widths = np.broadcast_to(np.asarray(widths, dtype=float), (len(segments),))
+    segments, widths = segments[widths > 0], widths[widths > 0]
+    if len(segments) == 0:
+        return
+    bands, band_widths = width_bands(widths, ratio)
+    order = np.argsort(bands, kind="stable")
+    starts = _coords(segments[order, 0], precision)
+    ends = _coords(segments[order, 1], precision)
+    sorted_bands = bands[order]
+
+    first = 0
+    for last in np.flatnonzero(np.diff(sorted_bands)).tolist() + [len(order) - 1]:
+        parts, tail = [], None
+        for i in range(first, last + 1):
+            if starts[i] != tail:
+                parts.append(f"M{starts[i]}")
+            parts.append(f"L{ends[i]}")
+            tail = ends[i]
+        yield float(band_widths[order[first]]), "".join(parts)
+        first = last + 1
+
+
+def leaf_symbols(widths, heights, colors, grow=0.0, bands=LEAF_SHAPE_BANDS):
+    # a handful of ellipse shapes per colour; every leaf references the
+    # closest one instead of carrying its own size and fill
+    widths, heights = np.asarray(widths, dtype=float), np.asarray(heights, dtype=float)
+    shapes = []
+    for values in (widths, heights):
+        lo, hi = (float(values.min()), float(values.max())) if len(values) else (0.0, 0.0)
+        step = (hi - lo) / bands or 1.0
+        index = np.clip(((values - lo) / step).astype(int), 0, bands - 1)
+        shapes.append((index, lo + (np.arange(bands) + 0.5) * step))
+    (w_index, w_centers), (h_index, h_centers) = shapes
+    palette, c_index = np.unique(np.asarray(colors), return_inverse=True)
+
+    symbol = (c_index * bands + w_index) * bands + h_index
+    used = np.unique(symbol).tolist()
+    defs = []
+    for s in used:
+        c, rest = divmod(s, bands * bands)
+        w, h = divmod(rest, bands)
+        defs.append((f"l{s}", (w_centers[w] + grow) / 2, (h_centers[h] + grow) / 2, str(palette[c])))
+    return symbol, defs
+
+
+def pot_path(root_x, root_y, precision=2):
+    v = _coords(rounded_trapezoid_verts(root_x, root_y - 30, top_width=100, bottom_width=140, height=30), precision)
+    return f"M{v[0]}L{v[1]}Q{v[2]} {v[3]}L{v[4]}Q{v[5]} {v[6]}Z"
+
+
+def soil_path(root_x, root_y, width=140, precision=2):
+    rx, ry = width * 0.75 / 2, 25 / 2
+    right, left = _coords([(root_x + rx, root_y), (root_x - rx, root_y)], precision)
+    return f"M{right}A{_fmt(rx, precision)} {_fmt(ry, precision)} 0 0 0 {left}"
+
+
+def write_svg(scene, filename, size=10, margin=0.1, precision=2, band_ratio=WIDTH_BAND_RATIO):
+    xmin, xmax, ymin, ymax = view_limits(scene["bounds"], scene["pad_points"], size, margin)
+    # strokes are specified in points like the raster backends, so convert once
+    unit = (xmax - xmin) / (size * 72)
+    f = lambda v: _fmt(v, precision)
+    pot_color, trunk_color = scene["pot_color"], scene["trunk_color"]
+    offsets, leaf_w, leaf_h, angles, colors = scene["leaves"]
+    symbol, defs = leaf_symbols(leaf_w, leaf_h, colors, grow=unit)
+
+    with open(filename, "w") as out:
+        out.write('<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+                  f'width="{size * 72}pt" height="{size * 72}pt" '
+                  f'viewBox="{f(xmin)} {f(-ymax)} {f(xmax - xmin)} {f(ymax - ymin)}">\n')
+        out.write("<defs>\n")
+        for name, rx, ry, color in defs:
+            out.write(f'<ellipse id="{name}" rx="{f(rx)}" ry="{f(ry)}" fill="{color}" opacity="{LEAF_ALPHA}"/>\n')
+        out.write("</defs>\n")
+        out.write(f'<rect x="{f(xmin)}" y="{f(-ymax)}" width="{f(xmax - xmin)}" height="{f(ymax - ymin)}" fill="white"/>\n')
+
+        # same stacking as the other backends: pot, branches, leaves, then trunks
+        out.write(f'<path d="{pot_path(*scene["pot_origin"], precision=precision)}" fill="{pot_color}"/>\n')
+        out.write(f'<path d="{soil_path(*scene["pot_origin"], precision=precision)}" fill="none" '
+                  f'stroke="{pot_color}" stroke-width="{f(SOIL_LINEWIDTH * unit)}"/>\n')
+
+        out.write(f'<g fill="none" stroke="{trunk_color}" stroke-linecap="square">\n')
+        for width, d in banded_paths(scene["branch_segments"], scene["branch_widths"], precision, band_ratio):
+            out.write(f'<path stroke-width="{f(width * unit)}" d="{d}"/>\n')
+        out.write("</g>\n<g>\n")
+
+        # matplotlib angles run counterclockwise with y up, so negate them here
+        for (x, y), a, s in zip(offsets.tolist(), np.asarray(angles).tolist(), symbol.tolist()):
+            out.write(f'<use xlink:href="#l{s}" transform="translate({f(x)} {f(-y)})rotate({f(-a)})"/>\n')
+        out.write("</g>\n")
+
+        trunk_segments = [np.stack([p[:-1], p[1:]], axis=1) for p, _ in scene["trunks"]]
+        trunk_widths = [w[:-1] for _, w in scene["trunks"]]
+        out.write(f'<g fill="none" stroke="{trunk_color}" stroke-linecap="round" stroke-linejoin="round">\n')
+        if trunk_segments:
+            for width, d in banded_paths(np.concatenate(trunk_segments), np.concatenate(trunk_widths), precision, band_ratio):
+                out.write(f'<path stroke-width="{f(width * unit)}" d="{d}"/>\n')
+        out.write("</g>\n</svg>\n")
+    return filename
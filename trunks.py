@@ -0,0 +1,148 @@
+import functools
+import numpy as np
+
+TRUNK_SAMPLES = 150
+
+
+def design_matrix(x, t, k):
+    # every degree k B-spline basis function on knots t at x, by de Boor's
+    # triangular recursion over the k + 1 functions that are nonzero there.
+    # Same values as scipy's BSpline.design_matrix, without importing scipy
+    # just to grow a trunk.
+    x = np.asarray(x, dtype=float)
+    t = np.asarray(t, dtype=float)
+    n = len(t) - k - 1
+    # x == t[-1] belongs to the last non-empty span
+    span = np.clip(np.searchsorted(t, x, side="right") - 1, k, n - 1)
+    N = np.zeros((len(x), k + 1))
+    N[:, 0] = 1.0
+    left = np.zeros((len(x), k + 1))
+    right = np.zeros((len(x), k + 1))
+    for j in range(1, k + 1):
+        left[:, j] = x - t[span + 1 - j]
+        right[:, j] = t[span + j] - x
+        saved = np.zeros(len(x))
+        for r in range(j):
+            temp = N[:, r] / (right[:, r + 1] + left[:, j - r])
+            N[:, r] = saved + right[:, r + 1] * temp
+            saved = left[:, j - r] * temp
+        N[:, j] = saved
+    matrix = np.zeros((len(x), n))
+    np.put_along_axis(matrix, span[:, None] - k + np.arange(k + 1), N, axis=1)
+    return matrix
+
+
+@functools.lru_cache(maxsize=None)
+def spline_basis(n, samples=TRUNK_SAMPLES):
+    # (samples, n) matrix taking n control points straight to the interpolating
+    # spline sampled on linspace(0, 1, samples). Control points sit at uniform
+    # parameters so the matrix is the same for every trunk with n points.
+    k = min(3, n - 1)
+    u = np.linspace(0, 1, n)
+    # same knot placement splprep uses for an s=0 fit
+    interior = u[(k + 1) // 2:n - (k + 1) // 2] if k % 2 else (u[k // 2:n - k // 2 - 1] + u[k // 2 + 1:n - k // 2]) / 2
+    t = np.concatenate([np.zeros(k + 1), interior, np.ones(k + 1)])
+
+    A = design_matrix(u, t, k)
+    E = design_matrix(np.linspace(0, 1, samples), t, k)
+    basis = E @ np.linalg.inv(A)
+    basis.setflags(write=False)
+    return basis
+
+
+def control_walks(count, n=6, start_pos=(0, 0), start_angle=90, length_range=(20, 40), rng=None):
+    rng = np.random if rng is None else rng
+    start = np.broadcast_to(np.asarray(start_pos, dtype=float), (count, 2))
+    angle = np.broadcast_to(np.asarray(start_angle, dtype=float), (count,)).copy()
+    total_angle_change = np.zeros(count)
+
+    ctrl = np.empty((count, n, 2))
+    ctrl[:, 0] = start
+    for i in range(1, n):
+        if i == 1:
+            delta_angle = rng.uniform(-30, 30, count)
+        else:
+            balance_bias = -0.2 * total_angle_change
+            delta_angle = rng.uniform(-40, 40, count) + balance_bias * 0.5
+        angle += delta_angle
+
+        length = rng.uniform(length_range[0], length_range[1], count)
+        dx = np.cos(np.radians(angle)) * length
+        dy = np.sin(np.radians(angle)) * length
+        if i == 1:
+            dy = np.where(dy < 10, 10 + np.abs(dy), dy)
+
+        ctrl[:, i, 0] = ctrl[:, i - 1, 0] + dx
+        ctrl[:, i, 1] = ctrl[:, i - 1, 1] + dy
+
+        if i >= 2:
+            prev = ctrl[:, i - 1] - ctrl[:, i - 2]
+            dtheta = np.degrees(np.arctan2(dy, dx) - np.arctan2(prev[:, 1], prev[:, 0]))
+            total_angle_change += (dtheta + 180) % 360 - 180
+
+    return ctrl
+
+
+def generate_trunk_curves(count, n=6, start_pos=(0, 0), start_angle=90, length_range=(20, 40), samples=TRUNK_SAMPLES, rng=None):
+    if n < 2:
+        return np.empty((count, 0)), np.empty((count, 0))
+    ctrl = control_walks(count, n, start_pos, start_angle, length_range, rng)
+    basis = spline_basis(n, samples)
+    xs = ctrl[:, :, 0] @ basis.T
+    ys = ctrl[:, :, 1] @ basis.T
+    return xs, ys
+
+
+def tangent_angles(xs, ys):
+    # central differences in degrees; the two end samples have no neighbour pair
+    xs, ys = np.atleast_2d(xs), np.atleast_2d(ys)
+    angles = np.full(xs.shape, np.nan)
+    angles[:, 1:-1] = np.degrees(np.arctan2(ys[:, 2:] - ys[:, :-2], xs[:, 2:] - xs[:, :-2]))
+    return angles
+
+
+def bud_candidates(length, step):
+    # sample indices scanned for buds, tip first
+    return np.arange(length - 2, 4, -step)
+
+
+def kdtree_class():
+    # scipy only loads once widths are assigned, not for bare generation
+    from scipy.spatial import cKDTree
+    return cKDTree
+
+
+class TrunkIndex:
+    # nearest-sample lookups over every trunk of one tree, built once per tree
+    def __init__(self, trunks, trunk_widths=None):
+        xs = [np.asarray(x, dtype=float) for x, _ in trunks]
+        ys = [np.asarray(y, dtype=float) for _, y in trunks]
+        self.points = np.column_stack([np.concatenate(xs), np.concatenate(ys)]) if xs else np.empty((0, 2))
+        self.trunk_ids = np.repeat(np.arange(len(xs)), [len(x) for x in xs])
+
+        arc, tangent = [], []
+        for x, y in zip(xs, ys):
+            seg = np.hypot(np.diff(x), np.diff(y))
+            arc.append(np.concatenate([[0.0], np.cumsum(seg)]))
+            # one-sided differences at the ends so every sample has a direction
+            tangent.append(np.degrees(np.arctan2(np.gradient(y), np.gradient(x))) if len(x) > 1 else np.zeros(len(x)))
+        self.arc_length = np.concatenate(arc) if arc else np.empty(0)
+        self.tangent = np.concatenate(tangent) if tangent else np.empty(0)
+        self.widths = np.concatenate([np.asarray(w, dtype=float) for w in trunk_widths]) if trunk_widths is not None else None
+        self.tree = kdtree_class()(self.points) if len(self.points) else None
+
+    def nearest(self, points):
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if self.tree is None:
+            return np.full(len(points), np.inf), np.full(len(points), -1)
+        return self.tree.query(points)
+
+    def query(self, points):
+        distance, idx = self.nearest(points)
+        return {
+            "distance": distance,
+            "trunk": self.trunk_ids[idx],
+            "width": self.widths[idx] if self.widths is not None else None,
+            "tangent": self.tangent[idx],
+            "arc_length": self.arc_length[idx],
+        }
@@ -1,42 +1,50 @@
+import argparse
+import glob
 import json
+import os
 import numpy as np
+from forest import BranchForest, as_forest
 
-def export_tree_to_json(filename, trunk_segments, buds, branch_trees=None, leaves=None):
-    def serialize_branch(node):
-        return {
-            "points": node["points"],
-            "children": [serialize_branch(child) for child in node["children"]]
-        }
+# nested "branches" makes the json module recurse once per level, so deeper
+# forests are written as flat "branch_forest" arrays instead
+NESTED_BRANCH_DEPTH_LIMIT = 100
 
+def skeleton_data(trunk_segments, buds, branch_trees=None, leaves=None, flat_branches=False):
     data = {
         "trunk": [
             {"points": [[float(x), float(y)] for x, y in zip(xs, ys)]}
             for xs, ys in trunk_segments
         ],
         "buds": [
-            {"pos": [float(b['pos'][0]), float(b['pos'][1])], "angle": float(b['angle']), "fate": b['fate']}
+            {"pos": [float(b['pos'][0]), float(b['pos'][1])], "angle": float(b['angle']), "fate": b['fate'],
+             **({"ratio": float(b['ratio'])} if 'ratio' in b else {})}
             for b in buds
         ]
     }
     if branch_trees is not None:
-        data["branches"] = [serialize_branch(tree) for tree in branch_trees]
+        forest = as_forest(branch_trees)
+        if flat_branches or (forest.node_count and forest.depth.max() >= NESTED_BRANCH_DEPTH_LIMIT):
+            data["branch_forest"] = {
+                "points": forest.points.tolist(),
+                "offsets": forest.offsets.tolist(),
+                "parents": forest.parents.tolist(),
+            }
+        else:
+            data["branches"] = forest.to_trees()
 
     if leaves is not None:
         data["leaves"] = [
             {"pos": [float(x), float(y)]} for x, y in leaves
         ]
+    return data
 
+def export_tree_to_json(filename, trunk_segments, buds, branch_trees=None, leaves=None, flat_branches=False):
+    data = skeleton_data(trunk_segments, buds, branch_trees, leaves, flat_branches)
     with open(filename, 'w') as f:
         json.dump(data, f, indent=2)
     print(f"Tree skeleton exported to {filename}")
 
 def import_tree_from_json(filename):
-    def deserialize_branch(data):
-        return {
-            "points": data["points"],
-            "children": [deserialize_branch(child) for child in data.get("children", [])]
-        }
-
     with open(filename, 'r') as f:
         data = json.load(f)
 
@@ -46,6 +54,190 @@ def import_tree_from_json(filename):
     ]
     buds = data.get("buds", [])
     leaves = [(leaf["pos"][0], leaf["pos"][1]) for leaf in data.get("leaves", [])]
-    branch_trees = [deserialize_branch(tree) for tree in data.get("branches", [])]
+    if "branch_forest" in data:
+        flat = data["branch_forest"]
+        branch_trees = BranchForest(flat["points"], flat["offsets"], flat["parents"])
+    else:
+        branch_trees = BranchForest.from_trees(data.get("branches", []))
+
+    return trunk_segments, buds, branch_trees, leaves
+
+
+# binary skeleton packs: a magic, a small JSON header describing each array,
+# then the raw arrays back to back. Every skeleton in the pack indexes into the
+# shared arrays through the *_start tables, so loading is just slicing a memmap.
+BINARY_MAGIC = b"BONSAI01"
+BINARY_ALIGN = 16
+FATES = ['grow', 'flower', 'dormant', 'abort']
+
+
+def export_trees_to_binary(filename, skeletons, names=None):
+    # names, one per skeleton, are kept in the header for unpacking
+    parts = {name: [] for name in (
+        "trunk_points", "trunk_offsets", "bud_pos", "bud_angle", "bud_fate", "bud_ratio",
+        "branch_points", "branch_offsets", "branch_parents", "leaves")}
+    starts = {name: [0] for name in ("trunk", "bud", "branch", "leaf")}
+    totals = {"trunk_points": 0, "branch_points": 0}
+
+    for trunk_segments, buds, branch_trees, leaves in skeletons:
+        for xs, ys in trunk_segments:
+            parts["trunk_points"].append(np.column_stack([xs, ys]))
+            totals["trunk_points"] += len(xs)
+            parts["trunk_offsets"].append([totals["trunk_points"]])
+        starts["trunk"].append(starts["trunk"][-1] + len(trunk_segments))
+
+        for b in buds:
+            parts["bud_pos"].append([b['pos']])
+            parts["bud_angle"].append([b['angle']])
+            parts["bud_fate"].append([FATES.index(b['fate'])])
+            parts["bud_ratio"].append([b.get('ratio', np.nan)])
+        starts["bud"].append(starts["bud"][-1] + len(buds))
+
+        forest = as_forest(branch_trees)
+        parts["branch_points"].append(forest.points)
+        parts["branch_offsets"].append(forest.offsets[1:] + totals["branch_points"])
+        parts["branch_parents"].append(forest.parents)
+        totals["branch_points"] += len(forest.points)
+        starts["branch"].append(starts["branch"][-1] + forest.node_count)
+
+        if leaves:
+            parts["leaves"].append(leaves)
+        starts["leaf"].append(starts["leaf"][-1] + len(leaves or []))
+
+    arrays = {}
+    for name, chunks in parts.items():
+        dtype = np.int32 if name in ("trunk_offsets", "bud_fate", "branch_offsets", "branch_parents") else np.float32
+        shape = (0, 2) if name in ("trunk_points", "bud_pos", "branch_points", "leaves") else (0,)
+        arrays[name] = np.concatenate([np.asarray(c, dtype=dtype).reshape((-1,) + shape[1:]) for c in chunks]) \
+            if chunks else np.empty(shape, dtype=dtype)
+    # offsets tables get a leading zero so item i spans [off[i], off[i + 1])
+    arrays["trunk_offsets"] = np.concatenate([[0], arrays["trunk_offsets"]]).astype(np.int32)
+    arrays["branch_offsets"] = np.concatenate([[0], arrays["branch_offsets"]]).astype(np.int32)
+    for name, values in starts.items():
+        arrays[f"{name}_start"] = np.asarray(values, dtype=np.int32)
+
+    header = {"count": len(starts["trunk"]) - 1, "arrays": {}}
+    if names is not None:
+        header["names"] = list(names)
+        if len(header["names"]) != header["count"]:
+            raise ValueError(f"{len(header['names'])} names for {header['count']} skeletons")
+    offset = 0
+    for name, arr in arrays.items():
+        header["arrays"][name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+        offset += -(-arr.nbytes // BINARY_ALIGN) * BINARY_ALIGN
+
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = -(-(len(BINARY_MAGIC) + 4 + len(header_bytes)) // BINARY_ALIGN) * BINARY_ALIGN
+    with open(filename, 'wb') as f:
+        f.write(BINARY_MAGIC)
+        f.write(np.uint32(len(header_bytes)).tobytes())
+        f.write(header_bytes)
+        for name, arr in arrays.items():
+            f.seek(data_start + header["arrays"][name]["offset"])
+            f.write(np.ascontiguousarray(arr).tobytes())
+        f.truncate(data_start + offset)
+    print(f"{header['count']} tree skeletons exported to {filename}")
+
+
+class SkeletonPack:
+    def __init__(self, filename):
+        self.filename = filename
+        self._mm = np.memmap(filename, dtype=np.uint8, mode='r')
+        if bytes(self._mm[:len(BINARY_MAGIC)]) != BINARY_MAGIC:
+            raise ValueError(f"{filename} is not a bonsai skeleton pack")
+        header_len = int(np.frombuffer(self._mm, dtype=np.uint32, count=1, offset=len(BINARY_MAGIC))[0])
+        header_end = len(BINARY_MAGIC) + 4 + header_len
+        header = json.loads(bytes(self._mm[len(BINARY_MAGIC) + 4:header_end]))
+        data_start = -(-header_end // BINARY_ALIGN) * BINARY_ALIGN
+
+        self.count = header["count"]
+        self.names = header.get("names")
+        self.arrays = {}
+        for name, info in header["arrays"].items():
+            dtype = np.dtype(info["dtype"])
+            n = int(np.prod(info["shape"]))
+            arr = np.frombuffer(self._mm, dtype=dtype, count=n, offset=data_start + info["offset"])
+            self.arrays[name] = arr.reshape(info["shape"])
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+    def raw(self, i):
+        # zero-copy views of skeleton i
+        a = self.arrays
+        t0, t1 = a["trunk_start"][i:i + 2]
+        b0, b1 = a["bud_start"][i:i + 2]
+        n0, n1 = a["branch_start"][i:i + 2]
+        l0, l1 = a["leaf_start"][i:i + 2]
+        trunk_offsets = a["trunk_offsets"][t0:t1 + 1]
+        branch_offsets = a["branch_offsets"][n0:n1 + 1]
+        return {
+            "trunk_points": a["trunk_points"][trunk_offsets[0]:trunk_offsets[-1]],
+            "trunk_offsets": trunk_offsets - trunk_offsets[0],
+            "bud_pos": a["bud_pos"][b0:b1],
+            "bud_angle": a["bud_angle"][b0:b1],
+            "bud_fate": a["bud_fate"][b0:b1],
+            "bud_ratio": a["bud_ratio"][b0:b1],
+            "branch_points": a["branch_points"][branch_offsets[0]:branch_offsets[-1]],
+            "branch_offsets": branch_offsets - branch_offsets[0],
+            "branch_parents": a["branch_parents"][n0:n1],
+            "leaves": a["leaves"][l0:l1],
+        }
+
+    def __getitem__(self, i):
+        if not -self.count <= i < self.count:
+            raise IndexError(i)
+        r = self.raw(i % self.count)
+        pts, off = r["trunk_points"].astype(float), r["trunk_offsets"]
+        trunk_segments = [(pts[off[k]:off[k + 1], 0], pts[off[k]:off[k + 1], 1]) for k in range(len(off) - 1)]
+        buds = [
+            {"pos": [float(x), float(y)], "angle": float(angle), "fate": FATES[fate], **({} if np.isnan(ratio) else {"ratio": ratio})}
+            for (x, y), angle, fate, ratio in zip(r["bud_pos"].tolist(), r["bud_angle"].tolist(), r["bud_fate"].tolist(),
+                                                  r["bud_ratio"].tolist())
+        ]
+        branch_trees = BranchForest(r["branch_points"], r["branch_offsets"], r["branch_parents"])
+        leaves = [tuple(p) for p in r["leaves"].tolist()]
+        return trunk_segments, buds, branch_trees, leaves
+
+
+def import_trees_from_binary(filename):
+    return list(SkeletonPack(filename))
+
+
+def convert_json_to_binary(json_files, filename):
+    json_files = list(json_files)
+    names = [os.path.splitext(os.path.basename(path))[0] for path in json_files]
+    if len(set(names)) != len(names):
+        raise ValueError("skeleton file names must be unique to unpack them again")
+    export_trees_to_binary(filename, (import_tree_from_json(path) for path in json_files), names=names)
+
+
+def convert_binary_to_json(filename, out_dir, prefix="ske_"):
+    # packs without names get prefix and their index
+    os.makedirs(out_dir, exist_ok=True)
+    pack = SkeletonPack(filename)
+    names = pack.names or [f"{prefix}{i}" for i in range(len(pack))]
+    for name, skeleton in zip(names, pack):
+        export_tree_to_json(os.path.join(out_dir, f"{name}.json"), *skeleton)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert skeletons between JSON files and a binary pack.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    pack = sub.add_parser("pack", help="pack JSON skeletons into one binary file")
+    pack.add_argument("inputs", nargs="+", help="JSON files or glob patterns")
+    pack.add_argument("-o", "--output", required=True)
+    unpack = sub.add_parser("unpack", help="write every skeleton in a pack back out as JSON")
+    unpack.add_argument("input")
+    unpack.add_argument("-o", "--output-dir", required=True)
+    args = parser.parse_args()
 
-    return trunk_segments, buds, branch_trees, leaves
\ No newline at end of file
+    if args.command == "pack":
+        files = sorted({path for pattern in args.inputs for path in (glob.glob(pattern) or [pattern])})
+        convert_json_to_binary(files, args.output)
+    else:
+        convert_binary_to_json(args.input, args.output_dir)